@@ -1,3 +1,4 @@
+import click
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
@@ -50,6 +51,64 @@ def create_app(config_class=Config):
     from app.main import bp as main_bp
     app.register_blueprint(main_bp)
 
+    # Booking listeners that keep the daily_stats rollup and the report cache current
+    from app import daily_stats, report_cache
+
+    # Start background jobs with the first request served by this process,
+    # so CLI commands (migrations, shell) never spawn them
+    @app.before_request
+    def start_background_jobs():
+        if app.testing:
+            return
+        from app.jobs import start_periodic
+        interval = app.config.get('EXPIRY_SWEEP_INTERVAL')
+        if interval:
+            from app.expiry import SWEEPER_JOB, check_expired_bookings
+            start_periodic(app, SWEEPER_JOB, interval, check_expired_bookings)
+        interval = app.config.get('OUTBOX_DELIVERY_INTERVAL')
+        if interval:
+            from app.outbox import DELIVERY_JOB, LEASE_SECONDS, run_delivery_job
+            start_periodic(app, DELIVERY_JOB, interval, run_delivery_job, ttl_seconds=max(LEASE_SECONDS, interval * 3))
+        interval = app.config.get('BROADCAST_INTERVAL')
+        if interval:
+            from app.broadcast import BROADCAST_JOB, LEASE_SECONDS as BROADCAST_LEASE_SECONDS, run_broadcasts
+            start_periodic(app, BROADCAST_JOB, interval, run_broadcasts,
+                           ttl_seconds=max(BROADCAST_LEASE_SECONDS, interval * 3))
+
+    @app.cli.command('expire-bookings')
+    def expire_bookings_command():
+        """Cancel overdue bookings once (for cron / scheduled tasks)."""
+        from app.expiry import check_expired_bookings
+        check_expired_bookings()
+
+    @app.cli.command('deliver-notifications')
+    def deliver_notifications_command():
+        """Send every due push notification in the outbox once."""
+        from app.outbox import drain_outbox
+        print(drain_outbox())
+
+    @app.cli.command('send-broadcasts')
+    def send_broadcasts_command():
+        """Run queued broadcasts to all customers once."""
+        from app.broadcast import run_broadcasts
+        run_broadcasts()
+
+    @app.cli.command('rebuild-daily-stats')
+    @click.option('--from', 'from_date', type=click.DateTime(['%Y-%m-%d']), help='First day, default: all')
+    @click.option('--to', 'to_date', type=click.DateTime(['%Y-%m-%d']), help='Last day, default: all')
+    def rebuild_daily_stats_command(from_date, to_date):
+        """Recompute the daily_stats rollup from bookings."""
+        from app.daily_stats import rebuild_daily_stats
+        written = rebuild_daily_stats(from_date and from_date.date(), to_date and to_date.date())
+        print(f"{written} rollup rows written")
+
+    @app.cli.command('prune-subscriptions')
+    def prune_subscriptions_command():
+        """Prune push subscriptions that failed too often and show active vs pruned counts."""
+        from app.notifications import prune_subscriptions, subscription_counts
+        print(prune_subscriptions())
+        print(subscription_counts())
+
     @app.context_processor
     def inject_settings():
         from app.models import SiteSettings
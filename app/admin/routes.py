@@ -3,7 +3,7 @@ from flask_login import login_required, current_user
 from app import db
 from app.admin import bp
 from app.admin.forms import EmployeeForm, ServiceForm, VehicleSizeForm, CityForm, NeighborhoodForm, ProductForm, SubscriptionPackageForm, SiteSettingsForm, NotificationForm, AdminUserForm
-from app.models import User, Service, VehicleSize, City, Neighborhood, Booking, Product, SubscriptionPackage, Subscription, EmployeeSchedule, SiteSettings, Notification, PushSubscription, BookingProduct, DiscountCode, Announcement
+from app.models import User, Service, VehicleSize, City, Neighborhood, Booking, Product, SubscriptionPackage, Subscription, EmployeeSchedule, SiteSettings, Notification, PushSubscription, BookingProduct, DiscountCode, Announcement, DailyStats
 from sqlalchemy import func, or_, extract
 from datetime import date, timedelta, time, datetime
 from werkzeug.utils import secure_filename
@@ -11,6 +11,11 @@ from urllib.parse import quote
 import os
 from pywebpush import webpush, WebPushException
 import json
+from app.slot_cache import slot_cache, invalidate_booking, invalidate_employee
+from app.schedule_cache import schedule_cache
+from app.outbox import enqueue_push
+from app.notifications import subscription_counts
+from app.pricing import price_booking
 
 @bp.before_request
 def before_request():
@@ -35,27 +40,21 @@ def index():
             employees_count = User.query.filter_by(role='employee').join(User.neighborhoods).filter(Neighborhood.id.in_(supervisor_neighborhood_ids)).distinct().count()
             # Fix AmbiguousForeignKeysError by specifying join condition
             customers_count = User.query.filter_by(role='customer').join(Booking, User.id == Booking.customer_id).filter(Booking.neighborhood_id.in_(supervisor_neighborhood_ids)).distinct().count()
-            bookings_count = Booking.query.filter(Booking.neighborhood_id.in_(supervisor_neighborhood_ids)).count()
+            stats_filters = [DailyStats.neighborhood_id.in_(supervisor_neighborhood_ids)]
         else:
             employees_count = 0
             customers_count = 0
-            bookings_count = 0
+            stats_filters = [DailyStats.id == -1] # Empty result
     else:
         employees_count = User.query.filter_by(role='employee').count()
         customers_count = User.query.filter_by(role='customer').count()
-        bookings_count = Booking.query.count()
+        stats_filters = []
     
-    # Calculate total revenue from completed bookings
-    completed_bookings_query = Booking.query.filter_by(status='completed')
-    
-    if current_user.role == 'supervisor':
-        if supervisor_neighborhood_ids:
-            completed_bookings_query = completed_bookings_query.filter(Booking.neighborhood_id.in_(supervisor_neighborhood_ids))
-        else:
-            completed_bookings_query = completed_bookings_query.filter_by(id=-1) # Empty result
-            
-    completed_bookings = completed_bookings_query.all()
-    total_revenue = sum(b.service.price for b in completed_bookings if b.service)
+    # Booking count and revenue of completed bookings from the daily_stats rollup
+    from app.daily_stats import stats_totals
+    booking_totals = stats_totals(*stats_filters)
+    bookings_count = booking_totals['bookings']
+    total_revenue = booking_totals['revenue']
     
     # Get recent bookings
     recent_bookings_query = Booking.query.order_by(Booking.date.desc(), Booking.time.desc())
@@ -215,6 +214,8 @@ def add_employee():
                 db.session.add(schedule)
         
         db.session.commit()
+        schedule_cache.invalidate()
+        invalidate_employee(user.id, [n.id for n in user.neighborhoods])
         flash(f'تم إضافة {"المشرف" if role == "supervisor" else "الموظف"} بنجاح')
         return redirect(url_for('admin.employees'))
     return render_template('admin/employee_form.html', form=form, title='إضافة موظف / مشرف')
@@ -265,6 +266,9 @@ def edit_employee(id):
         form.neighborhoods.choices = [(n.id, f"{n.city.name_ar} - {n.name_ar}") for n in all_neighborhoods if n.id in supervisor_neighborhood_ids]
 
     if request.method == 'POST':
+        # Neighborhoods before the edit, for availability cache invalidation
+        old_neighborhood_ids = [n.id for n in employee.neighborhoods]
+        
         # Update basic info
         employee.username = request.form.get('username')
         employee.email = request.form.get('email')
@@ -333,6 +337,8 @@ def edit_employee(id):
                         employee.neighborhoods.append(neighborhood)
         
         db.session.commit()
+        schedule_cache.invalidate()
+        invalidate_employee(employee.id, old_neighborhood_ids + [n.id for n in employee.neighborhoods])
         flash('تم تعديل البيانات بنجاح')
         return redirect(url_for('admin.employees'))
     
@@ -387,6 +393,8 @@ def employee_schedule(id):
                     continue
         
         db.session.commit()
+        schedule_cache.invalidate()
+        invalidate_employee(id, [n.id for n in employee.neighborhoods])
         flash('تم تحديث جدول العمل بنجاح')
         return redirect(url_for('admin.employees'))
 
@@ -398,8 +406,11 @@ def employee_schedule(id):
 @bp.route('/employees/delete/<int:id>')
 def delete_employee(id):
     employee = User.query.get_or_404(id)
+    neighborhood_ids = [n.id for n in employee.neighborhoods]
     db.session.delete(employee)
     db.session.commit()
+    schedule_cache.invalidate()
+    invalidate_employee(id, neighborhood_ids)
     flash('تم حذف الموظف')
     return redirect(url_for('admin.employees'))
 
@@ -407,7 +418,7 @@ def delete_employee(id):
 def employee_stats(id):
     employee = User.query.get_or_404(id)
     
-    # Get all assigned bookings
+    # Get all assigned bookings (listed on the page)
     bookings = Booking.query.filter_by(employee_id=employee.id).order_by(Booking.created_at.desc()).all()
     
     # Get all assigned subscriptions
@@ -419,21 +430,19 @@ def employee_stats(id):
     # Get assigned neighborhoods
     neighborhoods = employee.neighborhoods
     
-    # Calculate statistics
-    total_bookings = len(bookings)
-    completed_bookings = len([b for b in bookings if b.status == 'completed'])
+    # Calculate statistics from the daily_stats rollup
+    from app.daily_stats import stats_totals
+    booking_totals = stats_totals(DailyStats.employee_id == employee.id)
     active_subscriptions = len([s for s in subscriptions if s.status == 'active'])
     
-    # Calculate earnings from completed bookings
-    total_earnings = sum([b.service.price for b in bookings if b.service and b.status == 'completed']) if bookings else 0
-    
     stats = {
-        'total_bookings': total_bookings,
-        'completed_bookings': completed_bookings,
-        'pending_bookings': len([b for b in bookings if b.status in ['pending', 'assigned', 'en_route', 'in_progress']]),
+        'total_bookings': booking_totals['bookings'],
+        'completed_bookings': booking_totals['completed'],
+        # Everything not completed or cancelled is still open (pending, assigned, en_route, in_progress)
+        'pending_bookings': booking_totals['bookings'] - booking_totals['completed'] - booking_totals['cancelled'],
         'active_subscriptions': active_subscriptions,
         'total_subscriptions': len(subscriptions),
-        'total_earnings': total_earnings,
+        'total_earnings': booking_totals['revenue'],
         'assigned_neighborhoods': len(neighborhoods)
     }
     
@@ -580,39 +589,20 @@ def customer_stats(id):
     total_bookings = len(bookings)
     completed_bookings = len([b for b in bookings if b.status == 'completed'])
     
-    # Calculate accurate total spent including discounts and products
-    total_spent = 0
-    total_products_purchased = 0
-    total_products_value = 0
-    total_services_value = 0
-    
-    for booking in bookings:
-        if booking.status == 'completed':
-            # Calculate service price after discount/free wash
-            service_price = booking.service.price if booking.service else 0
-            discount_amount = 0
-            
-            # Check if free wash was used
-            if booking.used_free_wash:
-                service_price = 0
-            # Check if discount code was applied
-            elif booking.discount_code:
-                if booking.discount_code.discount_type == 'percentage':
-                    discount_amount = service_price * (booking.discount_code.value / 100)
-                else:
-                    discount_amount = booking.discount_code.value
-            
-            # Calculate final service price
-            final_service_price = service_price - discount_amount
-            total_services_value += final_service_price
-            
-            # Calculate products total
-            products_total = sum([bp.product.price * bp.quantity for bp in booking.products])
-            total_products_purchased += sum([bp.quantity for bp in booking.products])
-            total_products_value += products_total
-            
-            # Add to total spent
-            total_spent += final_service_price + products_total
+    # Totals of completed bookings from their price snapshots
+    completed = [b for b in bookings if b.status == 'completed']
+    total_spent = sum(b.total_amount for b in completed)
+    total_services_value = sum(b.service_amount - b.discount_amount for b in completed)
+    total_products_value = sum(b.products_amount for b in completed)
+    
+    # Product units bought (one query)
+    from sqlalchemy import func
+    total_products_purchased = db.session.query(
+        func.coalesce(func.sum(BookingProduct.quantity), 0)
+    ).join(Booking, Booking.id == BookingProduct.booking_id).filter(
+        Booking.customer_id == customer.id,
+        Booking.status == 'completed'
+    ).scalar()
     
     stats = {
         'total_bookings': total_bookings,
@@ -783,12 +773,18 @@ def services():
     services_list = Service.query.all()
     services_data = []
     
+    # Completed bookings and their service revenue per service (one grouped query on the rollup)
+    completed_by_service = {
+        service_id: (completed or 0, revenue or 0)
+        for service_id, completed, revenue in db.session.query(
+            DailyStats.service_id,
+            func.sum(DailyStats.completed),
+            func.sum(DailyStats.service_revenue)
+        ).filter(DailyStats.completed > 0).group_by(DailyStats.service_id).all()
+    }
+    
     for service in services_list:
-        # Calculate completed bookings count
-        completed_bookings_count = Booking.query.filter_by(service_id=service.id, status='completed').count()
-        
-        # Calculate total revenue
-        total_revenue = completed_bookings_count * service.price
+        completed_bookings_count, total_revenue = completed_by_service.get(service.id, (0, 0))
         
         services_data.append({
             'service': service,
@@ -892,14 +888,17 @@ def products():
     products_data = []
     total_sales_revenue = 0
     
+    # Quantity sold per product, only for completed bookings (one grouped query;
+    # products are not a daily_stats dimension)
+    sold_by_product = dict(
+        db.session.query(BookingProduct.product_id, func.sum(BookingProduct.quantity))
+        .join(Booking, BookingProduct.booking_id == Booking.id)
+        .filter(Booking.status == 'completed')
+        .group_by(BookingProduct.product_id).all()
+    )
+    
     for product in all_products:
-        # Get total quantity sold (only for completed bookings)
-        sold_quantity = db.session.query(func.sum(BookingProduct.quantity))\
-            .join(Booking, BookingProduct.booking_id == Booking.id)\
-            .filter(
-                BookingProduct.product_id == product.id,
-                Booking.status == 'completed'
-            ).scalar() or 0
+        sold_quantity = sold_by_product.get(product.id) or 0
         
         revenue = sold_quantity * product.price
         total_sales_revenue += revenue
@@ -1606,6 +1605,7 @@ def bookings():
 @bp.route('/bookings/create', methods=['POST'])
 def create_booking():
     from datetime import datetime, time as dt_time
+    from app.reservations import claim_slot
     
     customer_id = request.form.get('customer_id')
     service_id = request.form.get('service_id')
@@ -1647,13 +1647,20 @@ def create_booking():
         status=booking_status
     )
     db.session.add(booking)
-    db.session.commit()
+    db.session.flush()
     
-    # Notify employee if assigned
+    # Claim the employee's slot; refuse if another booking already holds it
+    if employee_id and not claim_slot(booking, int(employee_id)):
+        db.session.rollback()
+        flash('الموظف محجوز في هذا الوقت', 'error')
+        return redirect(url_for('admin.bookings'))
+    
+    price_booking(booking)
+    
+    # Notify employee if assigned (queued in the same transaction, sent after commit)
     if employee_id:
         employee = User.query.get(int(employee_id))
         if employee:
-            from app.notifications import send_push_notification
             notification_data = {
                 "title": "حجز جديد تم تعيينه لك 🆕",
                 "body": f"تم تعيين حجز جديد #{booking.id}\nالعميل: {booking.customer.username}\nالخدمة: {booking.service.name_ar}\nالموعد: {booking.date} {booking.time.strftime('%H:%M')}",
@@ -1664,235 +1671,119 @@ def create_booking():
                     "booking_id": booking.id
                 }
             }
-            send_push_notification(employee, notification_data)
-            
+            enqueue_push(employee.id, notification_data)
+    
+    db.session.commit()
+    invalidate_booking(booking)
     flash(f'تم إضافة الحجز بنجاح (الخصم: {discount}%)')
     return redirect(url_for('admin.bookings'))
 
-@bp.route('/api/available-slots/<int:employee_id>/<date>')
-def get_available_slots(employee_id, date):
-    from datetime import datetime, timedelta, time as dt_time
-    
-    # BOOKING DURATION: Each booking takes 90 minutes (1.5 hours)
-    BOOKING_DURATION_MINUTES = 90
-    
-    date_obj = datetime.strptime(date, '%Y-%m-%d').date()
-    day_of_week = date_obj.weekday()
-    
-    print(f"[DEBUG] Looking for slots: employee_id={employee_id}, date={date}, day_of_week={day_of_week}")
-    
-    schedule = EmployeeSchedule.query.filter_by(
-        employee_id=employee_id, 
-        day_of_week=day_of_week, 
-        is_active=True
-    ).first()
-    
-    print(f"[DEBUG] Found schedule: {schedule}")
-    if schedule:
-        print(f"[DEBUG] Schedule details: day={schedule.day_of_week}, start={schedule.start_time}, end={schedule.end_time}")
-    
-    if not schedule:
-        print(f"[DEBUG] No schedule found, returning empty")
-        return jsonify([])
-    
-    # Get all bookings for this employee on this date
-    bookings = Booking.query.filter_by(
-        employee_id=employee_id,
-        date=date_obj
-    ).all()
+@bp.route('/bookings/assign-pending', methods=['POST'])
+def assign_pending_bookings():
+    """Assign all unassigned pending bookings of a date in one batch"""
+    from datetime import datetime
+    from app.assignment import assign_pending_bookings as run_batch_assignment
     
-    # Build set of blocked time ranges (each booking blocks 90 minutes)
-    blocked_ranges = []
-    for booking in bookings:
-        booking_start = datetime.combine(date_obj, booking.time)
-        booking_end = booking_start + timedelta(minutes=BOOKING_DURATION_MINUTES)
-        blocked_ranges.append((booking_start, booking_end))
+    date_str = request.form.get('date')
+    try:
+        date_obj = datetime.strptime(date_str, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        flash('الرجاء اختيار تاريخ صحيح', 'error')
+        return redirect(url_for('admin.bookings'))
     
-    print(f"[DEBUG] Blocked ranges: {[(r[0].time(), r[1].time()) for r in blocked_ranges]}")
+    # Supervisors only assign bookings within their scope
+    scope_ids = None
+    if current_user.role == 'supervisor':
+        scope_ids = []
+        if current_user.supervisor_neighborhoods:
+            scope_ids.extend([n.id for n in current_user.supervisor_neighborhoods])
+        
+        if current_user.supervisor_cities:
+            for city in current_user.supervisor_cities:
+                scope_ids.extend([n.id for n in city.neighborhoods])
+    
+    assigned, unassigned = run_batch_assignment(date_obj, scope_ids)
+    
+    # One summary notification per employee rather than one per booking, committed with the assignments
+    per_employee = {}
+    for booking in assigned:
+        per_employee.setdefault(booking.employee_id, []).append(booking)
+    for employee_id, employee_bookings in per_employee.items():
+        times = ', '.join(b.time.strftime('%H:%M') for b in employee_bookings)
+        enqueue_push(employee_id, {
+            "title": "حجوزات جديدة تم تعيينها لك 🆕",
+            "body": f"تم تعيين {len(employee_bookings)} حجز لك بتاريخ {date_obj}\nالمواعيد: {times}",
+            "icon": "/static/images/logo.png",
+            "badge": "/static/images/logo.png",
+            "url": "/employee/bookings/active",
+            "data": {"booking_ids": [b.id for b in employee_bookings]}
+        })
+    db.session.commit()
     
-    # Get current time if booking for today
-    now = datetime.now()
-    is_today = date_obj == now.date()
-    current_time = now.time() if is_today else None
+    for booking in assigned:
+        invalidate_booking(booking)
     
-    print(f"[DEBUG] is_today={is_today}, current_time={current_time}")
+    flash(f'تم إسناد {len(assigned)} حجز، وتبقى {unassigned} بدون موظف متاح')
+    return redirect(url_for('admin.bookings', date=date_str))
+
+@bp.route('/api/available-slots/<int:employee_id>/<date>')
+def get_available_slots(employee_id, date):
+    from datetime import datetime
+    from app.availability import get_employee_free_slots, service_duration, booking_duration
     
-    slots = []
-    current = datetime.combine(date_obj, schedule.start_time)
-    end = datetime.combine(date_obj, schedule.end_time)
+    date_obj = datetime.strptime(date, '%Y-%m-%d').date()
     
-    # Generate slots every 90 minutes
-    while current < end:
-        slot_end = current + timedelta(minutes=BOOKING_DURATION_MINUTES)
-        
-        # Skip if slot would extend beyond working hours
-        if slot_end > end:
-            break
-        
-        time_str = current.strftime('%H:%M')
-        slot_time = current.time()
-        
-        # Skip if it's today and the time has passed
-        if is_today and current_time and slot_time <= current_time:
-            print(f"[DEBUG] Skipping {time_str} - past time")
-            current = current + timedelta(minutes=BOOKING_DURATION_MINUTES)
-            continue
-        
-        # Check if this slot overlaps with any blocked range
-        slot_blocked = False
-        for blocked_start, blocked_end in blocked_ranges:
-            # Check if there's any overlap
-            if current < blocked_end and slot_end > blocked_start:
-                slot_blocked = True
-                print(f"[DEBUG] Skipping {time_str} - conflicts with booking at {blocked_start.time()}")
-                break
-        
-        if not slot_blocked:
-            slots.append(time_str)
-        
-        current = current + timedelta(minutes=BOOKING_DURATION_MINUTES)
+    # Slot length comes from the service (?service_id=) or the booking being reassigned (?booking_id=)
+    booking_id = request.args.get('booking_id', type=int)
+    booking = Booking.query.get(booking_id) if booking_id else None
+    if booking:
+        duration = booking_duration(booking)
+    else:
+        service_id = request.args.get('service_id', type=int)
+        duration = service_duration(Service.query.get(service_id) if service_id else None)
     
-    print(f"[DEBUG] Final slots: {slots}")
-    return jsonify(slots)
+    return jsonify(get_employee_free_slots(employee_id, date_obj, datetime.now(), duration,
+                                           exclude_booking_id=booking.id if booking else None))
 
 @bp.route('/api/area-available-slots/<int:neighborhood_id>/<date>')
 def get_area_available_slots(neighborhood_id, date):
     """Get all available time slots from all employees in a neighborhood"""
-    from datetime import datetime, timedelta
-    from app.models import employee_neighborhoods
-    
-    # BOOKING DURATION: Each booking takes 90 minutes (1.5 hours)
-    BOOKING_DURATION_MINUTES = 90
+    from datetime import datetime
+    from app.availability import get_free_slots, service_duration
     
     date_obj = datetime.strptime(date, '%Y-%m-%d').date()
-    day_of_week = date_obj.weekday()
-    
-    # Get current time if booking for today
-    now = datetime.now()
-    is_today = date_obj == now.date()
-    current_time = now.time() if is_today else None
-    
-    # Get all employees in this neighborhood
-    employees = User.query.join(employee_neighborhoods).filter(
-        employee_neighborhoods.c.neighborhood_id == neighborhood_id,
-        User.role == 'employee'
-    ).all()
+    service_id = request.args.get('service_id', type=int)
+    duration = service_duration(Service.query.get(service_id) if service_id else None)
     
-    # Collect all available slots from all employees
-    all_slots = set()
-    for emp in employees:
-        schedule = EmployeeSchedule.query.filter_by(
-            employee_id=emp.id,
-            day_of_week=day_of_week,
-            is_active=True
-        ).first()
-        
-        if schedule:
-            # Get bookings for this employee
-            bookings = Booking.query.filter_by(
-                employee_id=emp.id,
-                date=date_obj
-            ).all()
-            
-            # Build blocked ranges
-            blocked_ranges = []
-            for booking in bookings:
-                booking_start = datetime.combine(date_obj, booking.time)
-                booking_end = booking_start + timedelta(minutes=BOOKING_DURATION_MINUTES)
-                blocked_ranges.append((booking_start, booking_end))
-            
-            current = datetime.combine(date_obj, schedule.start_time)
-            end = datetime.combine(date_obj, schedule.end_time)
-            
-            while current < end:
-                slot_end = current + timedelta(minutes=BOOKING_DURATION_MINUTES)
-                
-                # Skip if slot would extend beyond working hours
-                if slot_end > end:
-                    break
-                
-                time_str = current.strftime('%H:%M')
-                slot_time = current.time()
-                
-                # Skip if it's today and the time has passed
-                if is_today and current_time and slot_time <= current_time:
-                    current = current + timedelta(minutes=BOOKING_DURATION_MINUTES)
-                    continue
-                
-                # Check if this slot overlaps with any blocked range
-                slot_blocked = False
-                for blocked_start, blocked_end in blocked_ranges:
-                    if current < blocked_end and slot_end > blocked_start:
-                        slot_blocked = True
-                        break
-                
-                if not slot_blocked:
-                    all_slots.add(time_str)
-                
-                current = current + timedelta(minutes=BOOKING_DURATION_MINUTES)
-    
-    return jsonify(sorted(list(all_slots)))
+    # Same engine as the customer booking form, so both see identical slots
+    return jsonify(get_free_slots(neighborhood_id, date_obj, datetime.now(), duration))
+
+@bp.route('/api/availability-cache-stats')
+def availability_cache_stats():
+    """Hit/miss counters of the free-slot cache"""
+    return jsonify(slot_cache.stats())
 
-def auto_assign_employee(neighborhood_id, date, time_str):
+def auto_assign_employee(neighborhood_id, date, time_str, duration=None):
     """Automatically assign an available employee from the neighborhood"""
     from datetime import datetime, time as dt_time
-    from app.models import employee_neighborhoods
+    from app.assignment import pick_employee
+    from app.availability import BOOKING_DURATION_MINUTES
     
     date_obj = datetime.strptime(date, '%Y-%m-%d').date() if isinstance(date, str) else date
-    day_of_week = date_obj.weekday()
     
     # Convert time string to time object for comparison
     hour, minute = map(int, time_str.split(':'))
     time_obj = dt_time(hour, minute)
     
-    # Get all employees in this neighborhood
-    employees = User.query.join(employee_neighborhoods).filter(
-        employee_neighborhoods.c.neighborhood_id == neighborhood_id,
-        User.role == 'employee'
-    ).all()
-    
-    available_employees = []
-    for emp in employees:
-        # Check if employee has schedule for this day
-        schedule = EmployeeSchedule.query.filter_by(
-            employee_id=emp.id,
-            day_of_week=day_of_week,
-            is_active=True
-        ).first()
-        
-        if not schedule:
-            continue
-            
-        # Check if time is within working hours
-        if not (schedule.start_time <= time_obj < schedule.end_time):
-            continue
-        
-        # Check if not already booked
-        existing_booking = Booking.query.filter_by(
-            employee_id=emp.id,
-            date=date_obj,
-            time=time_str
-        ).first()
-        
-        if not existing_booking:
-            # Count today's bookings for load balancing
-            bookings_count = Booking.query.filter_by(
-                employee_id=emp.id,
-                date=date_obj
-            ).count()
-            available_employees.append((emp, bookings_count))
-    
-    if not available_employees:
-        return None
-    
-    # Sort by bookings count (load balancing) and return employee with least bookings
-    available_employees.sort(key=lambda x: x[1])
-    return available_employees[0][0].id
+    # Least loaded employee free for the whole slot, from one bulk load
+    return pick_employee(neighborhood_id, date_obj, time_obj, duration or BOOKING_DURATION_MINUTES)
 
 @bp.route('/bookings/<int:id>/reassign', methods=['POST'])
 def reassign_booking(id):
     """Reassign booking to a different employee in the same neighborhood"""
     from datetime import datetime, time as dt_time
+    from app.availability import employee_has_conflict, booking_duration
+    from app.reservations import claim_slot, release_slot
     
     booking = Booking.query.get_or_404(id)
     new_employee_id = request.form.get('employee_id')
@@ -1902,45 +1793,43 @@ def reassign_booking(id):
         flash('يجب اختيار موظف')
         return redirect(url_for('admin.bookings'))
     
-    # If time is being changed, convert and validate
+    # If time is being changed, convert it
+    new_time = booking.time
     if new_time_str:
         hour, minute = map(int, new_time_str.split(':'))
         new_time = dt_time(hour, minute)
-        
-        # Check if new employee is available at new time
-        existing = Booking.query.filter_by(
-            employee_id=int(new_employee_id),
-            date=booking.date,
-            time=new_time_str
-        ).first()
-        
-        if existing:
-            flash('الموظف محجوز في هذا الوقت')
-            return redirect(url_for('admin.bookings'))
-        
-        booking.time = new_time
-    else:
-        # Check availability at current time
-        existing = Booking.query.filter_by(
-            employee_id=int(new_employee_id),
-            date=booking.date,
-            time=booking.time.strftime('%H:%M')
-        ).first()
-        
-        if existing:
-            flash('الموظف محجوز في هذا الوقت')
-            return redirect(url_for('admin.bookings'))
+    
+    # Check the new employee has no overlapping booking (ignoring this one)
+    if employee_has_conflict(int(new_employee_id), booking.date, new_time, exclude_booking_id=booking.id,
+                             duration=booking_duration(booking)):
+        flash('الموظف محجوز في هذا الوقت')
+        return redirect(url_for('admin.bookings'))
+    
+    # Move the slot claim to the new employee/time atomically
+    old_employee_id = booking.employee_id
+    release_slot(booking)
+    booking.time = new_time
+    if not claim_slot(booking, int(new_employee_id)):
+        db.session.rollback()
+        flash('الموظف محجوز في هذا الوقت')
+        return redirect(url_for('admin.bookings'))
     
     booking.employee_id = int(new_employee_id)
     db.session.commit()
+    slot_cache.invalidate_employee(old_employee_id, booking.date)
+    invalidate_booking(booking)
     flash('تم إعادة إسناد الحجز بنجاح')
     return redirect(url_for('admin.bookings'))
 
 @bp.route('/bookings/<int:id>/cancel')
 def cancel_booking(id):
+    from app.reservations import release_slot
+    
     booking = Booking.query.get_or_404(id)
     booking.status = 'cancelled'
+    release_slot(booking)
     db.session.commit()
+    invalidate_booking(booking)
     flash('تم إلغاء الحجز')
     return redirect(url_for('admin.bookings'))
 
@@ -1949,14 +1838,15 @@ def delete_booking(id):
     booking = Booking.query.get_or_404(id)
     db.session.delete(booking)
     db.session.commit()
+    invalidate_booking(booking)
     flash('تم حذف الحجز نهائياً')
     return redirect(url_for('admin.bookings'))
 
 # --- Reports ---
 @bp.route('/reports')
 def reports():
-    from sqlalchemy import func, and_
     from datetime import datetime, timedelta
+    from app.report_cache import report_cache, shared_version
     
     # Get query parameters
     from_date_str = request.args.get('from_date', '')
@@ -1974,22 +1864,44 @@ def reports():
     else:
         to_date = datetime.strptime(to_date_str, '%Y-%m-%d').date()
     
-    # Base queries with date filter
-    bookings_query = Booking.query.join(Neighborhood).filter(
-        Booking.date >= from_date,
-        Booking.date <= to_date
-    )
+    # Supervisor scope: neighborhoods they manage directly or through a city
+    supervisor_neighborhood_ids = None
+    if current_user.role == 'supervisor':
+        supervisor_neighborhood_ids = []
+        if current_user.supervisor_neighborhoods:
+            supervisor_neighborhood_ids.extend([n.id for n in current_user.supervisor_neighborhoods])
+        
+        if current_user.supervisor_cities:
+            for city in current_user.supervisor_cities:
+                supervisor_neighborhood_ids.extend([n.id for n in city.neighborhoods])
     
-    completed_bookings_query = Booking.query.join(Neighborhood).filter(
-        Booking.date >= from_date,
-        Booking.date <= to_date,
-        Booking.status == 'completed'
-    )
+    # Same filters and scope give the same numbers: serve them from the report cache
+    key = report_cache.key(from_date, to_date, city_id, supervisor_neighborhood_ids)
+    version = shared_version()
+    report = report_cache.get(key, version)
+    if report is None:
+        generation = report_cache.generation
+        report = _report_figures(from_date, to_date, city_id, supervisor_neighborhood_ids)
+        report_cache.put(key, report, generation, version)
+    
+    return render_template('admin/reports.html',
+                           from_date=from_date.strftime('%Y-%m-%d'),
+                           city_id=city_id,
+                           to_date=to_date.strftime('%Y-%m-%d'),
+                           **report)
+
+
+def _report_figures(from_date, to_date, city_id, supervisor_neighborhood_ids):
+    """Every number on the reports page; supervisor_neighborhood_ids is None for admins"""
+    from sqlalchemy import func
+    from app.daily_stats import stats_totals
+    from app.revenue import booking_revenue, revenue_totals
     
-    # Filter by city if specified
+    # Filters on the daily_stats rollup shared by every booking figure below
+    # (bookings without a neighborhood never showed up in reports)
+    stats_filters = [DailyStats.date >= from_date, DailyStats.date <= to_date, DailyStats.neighborhood_id != 0]
     if city_id:
-        bookings_query = bookings_query.filter(Neighborhood.city_id == city_id)
-        completed_bookings_query = completed_bookings_query.filter(Neighborhood.city_id == city_id)
+        stats_filters.append(DailyStats.city_id == city_id)
     
     customers_query = User.query.filter_by(role='customer')
     
@@ -1999,88 +1911,9 @@ def reports():
         Subscription.status == 'active'
     )
     
-    # Payment Method Stats
-    cash_bookings = Booking.query.join(Neighborhood).filter(
-        Booking.date >= from_date,
-        Booking.date <= to_date,
-        Booking.status == 'completed',
-        Booking.payment_method == 'cash'
-    )
-    
-    card_bookings = Booking.query.join(Neighborhood).filter(
-        Booking.date >= from_date,
-        Booking.date <= to_date,
-        Booking.status == 'completed',
-        Booking.payment_method == 'card'
-    )
-    
-    if city_id:
-        cash_bookings = cash_bookings.filter(Neighborhood.city_id == city_id)
-        card_bookings = card_bookings.filter(Neighborhood.city_id == city_id)
-        
-    cash_count = cash_bookings.count()
-    card_count = card_bookings.count()
-    
-    # Calculate totals for cash/card
-    cash_total = 0
-    for b in cash_bookings.all():
-        if not b.service:
-            continue
-        price = b.service.price + (b.vehicle_size_price or 0)
-        # Add products
-        for bp in b.products:
-            price += bp.product.price * bp.quantity
-        # Apply discount/free wash
-        if b.used_free_wash:
-            price = 0 # Or just products if free wash only covers service? Assuming free wash covers service only.
-            # If free wash covers service, products are still paid?
-            # Let's assume free wash makes service 0.
-            # Re-calculate products only
-            p_total = sum(bp.product.price * bp.quantity for bp in b.products)
-            price = p_total
-        elif b.discount_code:
-            if b.discount_code.discount_type == 'percentage':
-                disc = (b.service.price + (b.vehicle_size_price or 0)) * b.discount_code.value / 100
-                price -= disc
-            else:
-                price -= b.discount_code.value
-            price = max(0, price)
-        
-        cash_total += price
-
-    card_total = 0
-    for b in card_bookings.all():
-        if not b.service:
-            continue
-        price = b.service.price + (b.vehicle_size_price or 0)
-        for bp in b.products:
-            price += bp.product.price * bp.quantity
-        if b.used_free_wash:
-             p_total = sum(bp.product.price * bp.quantity for bp in b.products)
-             price = p_total
-        elif b.discount_code:
-            if b.discount_code.discount_type == 'percentage':
-                disc = (b.service.price + (b.vehicle_size_price or 0)) * b.discount_code.value / 100
-                price -= disc
-            else:
-                price -= b.discount_code.value
-            price = max(0, price)
-        
-        card_total += price
-
-    # Filter for supervisor
-    if current_user.role == 'supervisor':
-        supervisor_neighborhood_ids = []
-        if current_user.supervisor_neighborhoods:
-            supervisor_neighborhood_ids.extend([n.id for n in current_user.supervisor_neighborhoods])
-        
-        if current_user.supervisor_cities:
-            for city in current_user.supervisor_cities:
-                supervisor_neighborhood_ids.extend([n.id for n in city.neighborhoods])
-        
+    if supervisor_neighborhood_ids is not None:
         if supervisor_neighborhood_ids:
-            bookings_query = bookings_query.filter(Booking.neighborhood_id.in_(supervisor_neighborhood_ids))
-            completed_bookings_query = completed_bookings_query.filter(Booking.neighborhood_id.in_(supervisor_neighborhood_ids))
+            stats_filters.append(DailyStats.neighborhood_id.in_(supervisor_neighborhood_ids))
             
             # Filter customers who have bookings in supervisor's area
             # Fix AmbiguousForeignKeysError by specifying join condition
@@ -2089,43 +1922,29 @@ def reports():
             subscriptions_query = subscriptions_query.filter(Subscription.neighborhood_id.in_(supervisor_neighborhood_ids))
         else:
             # No scope assigned
-            bookings_query = bookings_query.filter_by(id=-1)
-            completed_bookings_query = completed_bookings_query.filter_by(id=-1)
+            stats_filters.append(DailyStats.id == -1)
             customers_query = customers_query.filter_by(id=-1)
             subscriptions_query = subscriptions_query.filter_by(id=-1)
-
-    total_bookings = bookings_query.count()
-    completed_bookings = completed_bookings_query.count()
+    
+    # Booking counts (one query)
+    booking_totals = stats_totals(*stats_filters)
+    total_bookings = booking_totals['bookings']
+    completed_bookings = booking_totals['completed']
+    
     total_customers = customers_query.count()
     active_subscriptions = subscriptions_query.count()
     
-    # Revenue calculations with accurate pricing
-    completed_bookings_list = completed_bookings_query.all()
+    # Revenue of completed bookings per payment method (one grouped query)
+    revenue = booking_revenue(*stats_filters)
+    totals = revenue_totals(revenue)
     
-    service_revenue = 0
-    product_revenue = 0
+    cash_count = revenue.get('cash', {}).get('count', 0)
+    cash_total = revenue.get('cash', {}).get('paid', 0)
+    card_count = revenue.get('card', {}).get('count', 0)
+    card_total = revenue.get('card', {}).get('paid', 0)
     
-    for booking in completed_bookings_list:
-        # Calculate service price after discount/free wash
-        service_price = booking.service.price if booking.service else 0
-        discount_amount = 0
-        
-        # Check if free wash was used
-        if booking.used_free_wash:
-            service_price = 0
-        # Check if discount code was applied
-        elif booking.discount_code:
-            if booking.discount_code.discount_type == 'percentage':
-                discount_amount = service_price * (booking.discount_code.value / 100)
-            else:
-                discount_amount = booking.discount_code.value
-        
-        # Add service revenue (including vehicle size price)
-        service_revenue += (service_price - discount_amount + (booking.vehicle_size_price or 0))
-        
-        # Add product revenue
-        for bp in booking.products:
-            product_revenue += (bp.product.price * bp.quantity)
+    service_revenue = totals['service']
+    product_revenue = totals['products']
     
     # Subscription revenue (only active subscriptions created in date range)
     sub_rev_query = db.session.query(func.sum(SubscriptionPackage.price))\
@@ -2140,7 +1959,7 @@ def reports():
     if city_id:
         sub_rev_query = sub_rev_query.filter(Neighborhood.city_id == city_id)
         
-    if current_user.role == 'supervisor':
+    if supervisor_neighborhood_ids is not None:
         if supervisor_neighborhood_ids:
             sub_rev_query = sub_rev_query.filter(Subscription.neighborhood_id.in_(supervisor_neighborhood_ids))
         else:
@@ -2152,72 +1971,46 @@ def reports():
     total_revenue = service_revenue + product_revenue + subscription_revenue
     
     # Top services (in date range)
-    top_services_query = db.session.query(
+    top_services = db.session.query(
         Service.name_ar,
-        func.count(Booking.id).label('count')
-    ).join(Booking)\
-    .join(Neighborhood, Booking.neighborhood_id == Neighborhood.id)\
-    .filter(
-        Booking.date >= from_date,
-        Booking.date <= to_date
-    )
-    
-    if city_id:
-        top_services_query = top_services_query.filter(Neighborhood.city_id == city_id)
-    
-    if current_user.role == 'supervisor':
-        if supervisor_neighborhood_ids:
-            top_services_query = top_services_query.filter(Booking.neighborhood_id.in_(supervisor_neighborhood_ids))
-        else:
-            top_services_query = top_services_query.filter(Booking.id == -1)
-        
-    top_services = top_services_query.group_by(Service.id)\
-    .order_by(func.count(Booking.id).desc())\
+        func.sum(DailyStats.bookings).label('count')
+    ).join(Service, Service.id == DailyStats.service_id)\
+    .filter(*stats_filters)\
+    .group_by(Service.id)\
+    .order_by(func.sum(DailyStats.bookings).desc())\
     .limit(5).all()
     
     # Employee performance (in date range)
-    from sqlalchemy import case
-    employee_stats_query = db.session.query(
+    employee_stats = db.session.query(
         User.username,
-        func.count(Booking.id).label('total'),
-        func.sum(case((Booking.status == 'completed', 1), else_=0)).label('completed')
-    ).join(Booking, User.id == Booking.employee_id)\
-    .join(Neighborhood, Booking.neighborhood_id == Neighborhood.id)\
-    .filter(
-        User.role == 'employee',
-        Booking.date >= from_date,
-        Booking.date <= to_date
-    )
-    
-    if city_id:
-        employee_stats_query = employee_stats_query.filter(Neighborhood.city_id == city_id)
+        func.sum(DailyStats.bookings).label('total'),
+        func.sum(DailyStats.completed).label('completed')
+    ).join(User, User.id == DailyStats.employee_id)\
+    .filter(User.role == 'employee', *stats_filters)\
+    .group_by(User.id).all()
     
-    if current_user.role == 'supervisor':
-        if supervisor_neighborhood_ids:
-            employee_stats_query = employee_stats_query.filter(Booking.neighborhood_id.in_(supervisor_neighborhood_ids))
-        else:
-            employee_stats_query = employee_stats_query.filter(Booking.id == -1)
-        
-    employee_stats = employee_stats_query.group_by(User.id).all()
-    
-    return render_template('admin/reports.html', 
-                           total_bookings=total_bookings,
-                           completed_bookings=completed_bookings,
-                           total_customers=total_customers,
-                           active_subscriptions=active_subscriptions,
-                           service_revenue=service_revenue,
-                           product_revenue=product_revenue,
-                           subscription_revenue=subscription_revenue,
-                           total_revenue=total_revenue,
-                           top_services=top_services,
-                           employee_stats=employee_stats,
-                           cash_count=cash_count,
-                           cash_total=cash_total,
-                           card_count=card_count,
-                           card_total=card_total,
-                           from_date=from_date.strftime('%Y-%m-%d'),
-                           city_id=city_id,
-                           to_date=to_date.strftime('%Y-%m-%d'))
+    return {
+        'total_bookings': total_bookings,
+        'completed_bookings': completed_bookings,
+        'total_customers': total_customers,
+        'active_subscriptions': active_subscriptions,
+        'service_revenue': service_revenue,
+        'product_revenue': product_revenue,
+        'subscription_revenue': subscription_revenue,
+        'total_revenue': total_revenue,
+        'top_services': top_services,
+        'employee_stats': employee_stats,
+        'cash_count': cash_count,
+        'cash_total': cash_total,
+        'card_count': card_count,
+        'card_total': card_total
+    }
+
+@bp.route('/api/report-cache-stats')
+def report_cache_stats():
+    """Hit/miss counters of the reports cache"""
+    from app.report_cache import report_cache
+    return jsonify(report_cache.stats())
 
 # --- Settings (Loyalty, Admin Accounts, Backup) ---
 @bp.route('/settings/loyalty', methods=['GET', 'POST'])
@@ -2308,9 +2101,11 @@ def settings():
 @bp.route('/notifications/send', methods=['GET', 'POST'])
 @login_required
 def send_notification():
+    from app.models import Broadcast
+    
     form = NotificationForm()
-    # Populate user choices
-    users = User.query.filter(User.role == 'customer').all()
+    # Populate user choices (only the columns the list needs)
+    users = db.session.query(User.id, User.username, User.phone).filter(User.role == 'customer').all()
     choices = [(0, 'All Customers')] + [(u.id, f"{u.username} ({u.phone})") for u in users]
     form.user_id.choices = choices
 
@@ -2319,22 +2114,21 @@ def send_notification():
         message = form.message.data
         recipient_id = form.user_id.data
 
-        targets = []
+        # All customers: fanned out by the broadcast job, the page polls its progress
         if recipient_id == 0:
-            targets = users
-        else:
-            targets = [User.query.get(recipient_id)]
+            broadcast = Broadcast(title=title, message=message, created_by=current_user.id)
+            db.session.add(broadcast)
+            db.session.commit()
+            flash('جاري إرسال الإشعار لجميع العملاء', 'success')
+            return redirect(url_for('admin.send_notification', broadcast=broadcast.id))
 
-        count = 0
-        for user in targets:
-            if not user: continue
-            
+        user = User.query.get(recipient_id)
+        if user:
             # 1. Create DB Notification
             notif = Notification(user_id=user.id, title=title, message=message)
             db.session.add(notif)
             
-            # 2. Send Web Push using the improved notification function
-            from app.notifications import send_push_notification
+            # 2. Queue Web Push (sent by the outbox worker after commit)
             notification_data = {
                 "title": title,
                 "body": message,
@@ -2342,15 +2136,49 @@ def send_notification():
                 "badge": "/static/images/logo.png",
                 "url": "/notifications"
             }
-            send_push_notification(user, notification_data)
-            
-            count += 1
+            enqueue_push(user.id, notification_data)
         
         db.session.commit()
-        flash(f'Notification sent to {count} users.', 'success')
+        flash(f'Notification sent to {1 if user else 0} users.', 'success')
         return redirect(url_for('admin.send_notification'))
 
-    return render_template('admin/notifications.html', form=form)
+    broadcast_id = request.args.get('broadcast', type=int)
+    broadcast = Broadcast.query.get(broadcast_id) if broadcast_id else None
+    return render_template('admin/notifications.html', form=form, broadcast=broadcast,
+                           subscriptions=subscription_counts())
+
+
+@bp.route('/notifications/broadcasts/<int:id>')
+@login_required
+def broadcast_status(id):
+    """Progress of a broadcast, polled by the notifications page"""
+    from app.models import Broadcast
+    
+    broadcast = Broadcast.query.get_or_404(id)
+    return jsonify(broadcast.to_dict())
+
+
+@bp.route('/notifications/subscriptions')
+@login_required
+def push_subscription_counts():
+    """Active vs pruned push subscriptions"""
+    return jsonify(subscription_counts())
+
+
+@bp.route('/notifications/metrics')
+@login_required
+def push_metrics_page():
+    """Push delivery latency and outcomes per push service; ?format=json for scrapers"""
+    from app.push_metrics import push_metrics, queue_depths, outbox_outcome
+    
+    metrics = push_metrics.snapshot()
+    metrics['queues'] = queue_depths()
+    metrics['outbox'] = outbox_outcome()
+    metrics['subscriptions'] = subscription_counts()
+    
+    if request.args.get('format') == 'json':
+        return jsonify(metrics)
+    return render_template('admin/push_metrics.html', metrics=metrics)
 
 
 # --- Discount Code Management ---
@@ -0,0 +1,381 @@
+"""
+Employee assignment service.
+Decides who gets a booking from one bulk load of the candidates' schedules and
+day bookings: only employees free for the whole slot (true interval overlap)
+qualify, and they are scored by their load that day plus the estimated drive
+from where they will be (previous booking, or live location today) to the car.
+"""
+import math
+from datetime import date
+from app import db
+from app.models import Booking, User, EmployeeLocation, employee_neighborhoods
+from app.availability import EmployeeAvailability, BOOKING_DURATION_MINUTES, TICK_MINUTES, booking_duration, span_mask, to_minutes
+from app.reservations import claim_slots
+
+EARTH_RADIUS_KM = 6371.0
+
+# Rough city driving speed (~30 km/h): each km costs as much as 2 booked minutes
+TRAVEL_MINUTES_PER_KM = 2
+
+
+def haversine_km(lat, lng, points):
+    """Great-circle distances in km from (lat, lng) to every (lat, lng) in points.
+    Computed in one pass over the whole candidate list, with the origin terms hoisted."""
+    lat1 = math.radians(lat)
+    lng1 = math.radians(lng)
+    cos_lat1 = math.cos(lat1)
+    lats = [math.radians(p[0]) for p in points]
+    lngs = [math.radians(p[1]) for p in points]
+    return [
+        2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(
+            math.sin((lat2 - lat1) / 2) ** 2
+            + cos_lat1 * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+        )))
+        for lat2, lng2 in zip(lats, lngs)
+    ]
+
+
+def live_locations(employee_ids):
+    """{employee_id: (lat, lng)} of employees currently sharing their location (one query)"""
+    if not employee_ids:
+        return {}
+    rows = db.session.query(
+        EmployeeLocation.employee_id,
+        EmployeeLocation.latitude,
+        EmployeeLocation.longitude
+    ).filter(
+        EmployeeLocation.employee_id.in_(list(employee_ids)),
+        EmployeeLocation.is_tracking == True
+    ).all()
+    return {employee_id: (lat, lng) for employee_id, lat, lng in rows}
+
+
+def travel_minutes(availability, day, start, employee_ids, location, live=None, planned=None):
+    """Estimated drive (minutes) for each employee to reach `location` for a booking at `start`.
+    Origin is the employee's previous located booking that day, else their live location;
+    planned maps employee_id -> [(start_min, lat, lng)] of bookings planned but not stored yet.
+    Employees with no known origin get the average of the others, so they are neither
+    favoured nor penalised. Returns a list aligned with employee_ids (all 0 without a location)."""
+    if not location or location[0] is None or location[1] is None:
+        return [0] * len(employee_ids)
+
+    live = live or {}
+    planned = planned or {}
+    origins = []
+    known = []
+    for employee_id in employee_ids:
+        origin = (availability.occupancy(employee_id, day).previous_stop(start, planned.get(employee_id, ()))
+                  or live.get(employee_id))
+        if origin is not None:
+            known.append(len(origins))
+        origins.append(origin)
+
+    if not known:
+        return [0] * len(employee_ids)
+
+    distances = haversine_km(location[0], location[1], [origins[i] for i in known])
+    minutes = [0] * len(employee_ids)
+    for index, km in zip(known, distances):
+        minutes[index] = km * TRAVEL_MINUTES_PER_KM
+    average = sum(minutes[i] for i in known) / len(known)
+    known_set = set(known)
+    return [m if i in known_set else average for i, m in enumerate(minutes)]
+
+
+def rank_candidates(availability, day, start, duration=BOOKING_DURATION_MINUTES, location=None, live=None):
+    """Free employee ids ordered by booked minutes plus travel minutes, then by id"""
+    candidates = availability.available_employee_ids(day, start, duration)
+    travel = travel_minutes(availability, day, start, candidates, location, live)
+    scores = {
+        employee_id: availability.occupancy(employee_id, day).booked_minutes() + minutes
+        for employee_id, minutes in zip(candidates, travel)
+    }
+    return sorted(candidates, key=lambda employee_id: (scores[employee_id], employee_id))
+
+
+def rank_employees(neighborhood_id, day, booking_time, duration=BOOKING_DURATION_MINUTES, location=None):
+    """Neighborhood employees free at this date/time, best scored first.
+    location is the car's (lat, lng) when known."""
+    availability = EmployeeAvailability.for_neighborhood(neighborhood_id, day)
+    live = None
+    # Live positions only say where someone is now, so they only matter for today
+    if location and day == date.today():
+        live = live_locations(availability.employee_ids())
+    return rank_candidates(availability, day, to_minutes(booking_time), duration, location, live)
+
+
+def pick_employee(neighborhood_id, day, booking_time, duration=BOOKING_DURATION_MINUTES, location=None):
+    """Best scored free employee id, or None"""
+    ranked = rank_employees(neighborhood_id, day, booking_time, duration, location)
+    return ranked[0] if ranked else None
+
+
+# Cost used for "leave this booking unassigned"; any feasible pair is cheaper
+UNASSIGNED_COST = 10 ** 6
+INFEASIBLE_COST = 10 ** 9
+
+# Bookings moved in a row to make room for one more while repairing a day plan
+MAX_REPAIR_MOVES = 3
+
+
+def min_cost_assignment(cost):
+    """Hungarian algorithm for an n x m cost matrix with n <= m.
+    Returns a list giving the column chosen for each row, minimising the total cost."""
+    n = len(cost)
+    m = len(cost[0]) if n else 0
+    u = [0] * (n + 1)
+    v = [0] * (m + 1)
+    p = [0] * (m + 1)  # p[j]: row matched to column j (1-based, 0 = free)
+    way = [0] * (m + 1)
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = [float('inf')] * (m + 1)
+        used = [False] * (m + 1)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            delta = float('inf')
+            j1 = 0
+            for j in range(1, m + 1):
+                if not used[j]:
+                    cur = cost[i0 - 1][j - 1] - u[i0] - v[j]
+                    if cur < minv[j]:
+                        minv[j] = cur
+                        way[j] = j0
+                    if minv[j] < delta:
+                        delta = minv[j]
+                        j1 = j
+            for j in range(m + 1):
+                if used[j]:
+                    u[p[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+    result = [None] * n
+    for j in range(1, m + 1):
+        if p[j]:
+            result[p[j] - 1] = j - 1
+    return result
+
+
+class _DayPlan:
+    """Bookings of one day planned on top of the employees' stored bookings.
+    Planned ticks are kept per employee as bitsets, like DayOccupancy, so they can be
+    taken back when the repair step moves a booking to someone else."""
+
+    def __init__(self, bookings, availability, serves, live=None):
+        self.bookings = bookings
+        self.availability = availability
+        self.live = live
+        self.day = bookings[0][1]
+        self.starts = [to_minutes(booking[2]) for booking in bookings]
+        self.masks = [span_mask(start, start + booking[3]) for start, booking in zip(self.starts, bookings)]
+        # Employees serving the neighborhood and free for the slot before anything is planned
+        employee_ids = availability.employee_ids()
+        self.eligible = [
+            [
+                employee_id for employee_id in employee_ids
+                if booking[4] in serves.get(employee_id, ()) and availability.is_free(employee_id, self.day, start, booking[3])
+            ]
+            for start, booking in zip(self.starts, bookings)
+        ]
+        self.owner = [None] * len(bookings)
+        self.bits = {}  # employee_id -> ticks of planned bookings
+        self.planned = {}  # employee_id -> [booking index]
+
+    def is_free(self, index, employee_id):
+        return not self.bits.get(employee_id, 0) & self.masks[index]
+
+    def conflicts(self, index, employee_id):
+        return [other for other in self.planned.get(employee_id, ()) if self.masks[other] & self.masks[index]]
+
+    def assign(self, index, employee_id):
+        self.owner[index] = employee_id
+        self.bits[employee_id] = self.bits.get(employee_id, 0) | self.masks[index]
+        self.planned.setdefault(employee_id, []).append(index)
+
+    def unassign(self, index):
+        employee_id = self.owner[index]
+        self.owner[index] = None
+        self.bits[employee_id] &= ~self.masks[index]
+        self.planned[employee_id].remove(index)
+
+    def costs(self, index, employee_ids):
+        """Minutes already booked (stored + planned) plus travel minutes, per employee"""
+        _, day, _, _, _, lat, lng = self.bookings[index]
+        stops = {
+            employee_id: [
+                (self.starts[other], self.bookings[other][5], self.bookings[other][6])
+                for other in self.planned.get(employee_id, ())
+                if self.bookings[other][5] is not None and self.bookings[other][6] is not None
+            ]
+            for employee_id in employee_ids
+        }
+        travel = travel_minutes(self.availability, day, self.starts[index], employee_ids, (lat, lng), self.live, stops)
+        return [
+            self.availability.occupancy(employee_id, day).booked_minutes()
+            + bin(self.bits.get(employee_id, 0)).count('1') * TICK_MINUTES
+            + round(minutes)
+            for employee_id, minutes in zip(employee_ids, travel)
+        ]
+
+    def assign_group(self, group):
+        """Min-cost assignment of bookings that all overlap each other, so each employee takes at most one"""
+        candidates = sorted({
+            employee_id for index in group for employee_id in self.eligible[index] if self.is_free(index, employee_id)
+        })
+        if not candidates:
+            return
+        cost = []
+        for index in group:
+            feasible = {employee_id for employee_id in self.eligible[index] if self.is_free(index, employee_id)}
+            row = [
+                score if employee_id in feasible else INFEASIBLE_COST
+                for employee_id, score in zip(candidates, self.costs(index, candidates))
+            ]
+            # One "unassigned" column per booking keeps the matrix wide enough
+            row.extend([UNASSIGNED_COST] * len(group))
+            cost.append(row)
+
+        for row_index, column in enumerate(min_cost_assignment(cost)):
+            if column is None or column >= len(candidates) or cost[row_index][column] >= INFEASIBLE_COST:
+                continue
+            self.assign(group[row_index], candidates[column])
+
+    def place(self, index, depth, visited):
+        """Put an unplanned booking on its cheapest free employee or, failing that, on an
+        employee whose single overlapping booking can itself be placed elsewhere (up to
+        `depth` moves in a row). visited holds the employees already tried in this search."""
+        free = [employee_id for employee_id in self.eligible[index] if self.is_free(index, employee_id)]
+        if free:
+            costs = self.costs(index, free)
+            self.assign(index, free[costs.index(min(costs))])
+            return True
+        if not depth:
+            return False
+        for employee_id in self.eligible[index]:
+            if employee_id in visited:
+                continue
+            visited.add(employee_id)
+            conflicts = self.conflicts(index, employee_id)
+            if len(conflicts) != 1:
+                continue
+            moved = conflicts[0]
+            self.unassign(moved)
+            self.assign(index, employee_id)
+            if self.place(moved, depth - 1, visited):
+                return True
+            self.unassign(index)
+            self.assign(moved, employee_id)
+        return False
+
+
+def plan_assignments(bookings, availability, serves, live=None):
+    """Assign (booking_id, date, time, duration, neighborhood_id, lat, lng) tuples to employees for one day.
+    serves maps employee_id -> set of neighborhood ids they cover.
+    With per-employee hours and neighborhoods this is an NP-hard interval scheduling problem,
+    so the day is planned in two passes rather than solved exactly:
+    1. Sweep the day in groups of bookings that all overlap one moment (e.g. 09:00 and 09:15);
+       each group is one min-cost assignment (cost = minutes already booked + travel minutes).
+    2. Repair over the whole day: every booking still unplaced is retried, moving one
+       overlapping booking at a time to another employee (up to MAX_REPAIR_MOVES deep) to
+       make room, so an employee taken early in the day can be freed for a later booking.
+    Returns {booking_id: employee_id}."""
+    if not bookings:
+        return {}
+    plan = _DayPlan(bookings, availability, serves, live)
+    ends = [start + max(booking[3], 1) for start, booking in zip(plan.starts, bookings)]
+
+    pending = sorted(range(len(bookings)), key=lambda index: (plan.starts[index], bookings[index][0]))
+    while pending:
+        # Everything starting before the earliest end overlaps that moment
+        cut = min(ends[index] for index in pending)
+        plan.assign_group([index for index in pending if plan.starts[index] < cut])
+        pending = [index for index in pending if plan.starts[index] >= cut]
+
+    # Most constrained bookings first; a failed search is not repeated for the same
+    # (start, duration, neighborhood) until something changes
+    unplaced = sorted(
+        (index for index, owner in enumerate(plan.owner) if owner is None),
+        key=lambda index: (len(plan.eligible[index]), plan.starts[index], bookings[index][0])
+    )
+    progress = True
+    while unplaced and progress:
+        progress = False
+        failed = set()
+        for index in unplaced:
+            signature = (plan.starts[index], bookings[index][3], bookings[index][4])
+            if signature in failed:
+                continue
+            if plan.place(index, MAX_REPAIR_MOVES, set()):
+                progress = True
+                failed.clear()
+            else:
+                failed.add(signature)
+        unplaced = [index for index in unplaced if plan.owner[index] is None]
+
+    return {
+        bookings[index][0]: employee_id
+        for index, employee_id in enumerate(plan.owner) if employee_id is not None
+    }
+
+
+def assign_pending_bookings(day, neighborhood_ids=None):
+    """Batch job: assign every unassigned pending booking on a date.
+    Optionally limited to some neighborhoods (supervisor scope).
+    The caller commits. Returns (assigned Booking list, number left unassigned)."""
+    query = Booking.query.filter(
+        Booking.date == day,
+        Booking.status == 'pending',
+        Booking.employee_id.is_(None),
+        Booking.time.isnot(None),
+        Booking.neighborhood_id.isnot(None)
+    )
+    if neighborhood_ids is not None:
+        query = query.filter(Booking.neighborhood_id.in_(neighborhood_ids))
+    pending = query.order_by(Booking.time, Booking.id).all()
+    if not pending:
+        return [], 0
+
+    # Who serves the neighborhoods involved (one query)
+    rows = db.session.query(
+        employee_neighborhoods.c.employee_id,
+        employee_neighborhoods.c.neighborhood_id
+    ).join(
+        User, User.id == employee_neighborhoods.c.employee_id
+    ).filter(
+        employee_neighborhoods.c.neighborhood_id.in_({b.neighborhood_id for b in pending}),
+        User.role == 'employee'
+    ).all()
+    serves = {}
+    for employee_id, neighborhood_id in rows:
+        serves.setdefault(employee_id, set()).add(neighborhood_id)
+    if not serves:
+        return [], len(pending)
+
+    # Schedules and the day's existing load for all of them (two queries)
+    availability = EmployeeAvailability.for_employees(sorted(serves), day)
+    live = live_locations(serves) if day == date.today() else None
+    plan = plan_assignments(
+        [(b.id, b.date, b.time, booking_duration(b), b.neighborhood_id, b.location_lat, b.location_lng) for b in pending],
+        availability,
+        serves,
+        live=live
+    )
+
+    # The slot claims stay authoritative against concurrent customer bookings
+    claimed = claim_slots([(booking, plan[booking.id]) for booking in pending if booking.id in plan], day)
+    assigned = []
+    for booking, employee_id in claimed:
+        booking.employee_id = employee_id
+        booking.status = 'assigned'
+        assigned.append(booking)
+    return assigned, len(pending) - len(assigned)
@@ -0,0 +1,295 @@
+"""
+Slot availability engine.
+Reads compiled weekly schedules from memory, loads active bookings in bulk
+and keeps each employee's day as a bitset of 5-minute ticks, so "is this
+employee free" is a single mask test and an availability check costs one
+query no matter how many employees or slots are involved.
+Each booking blocks its own service's duration, and slots are offered on a
+15-minute grid inside the free gaps of the day.
+"""
+from datetime import datetime, timedelta
+from itertools import chain
+from app import db
+from app.models import Booking, DEFAULT_BOOKING_DURATION
+from app.slot_cache import slot_cache
+from app.schedule_cache import schedule_cache
+
+# Bookings in these statuses occupy the employee's time
+ACTIVE_STATUSES = ['pending', 'assigned', 'en_route', 'arrived', 'in_progress']
+
+# Duration used when a service has none set
+BOOKING_DURATION_MINUTES = DEFAULT_BOOKING_DURATION
+
+# Offered start times are multiples of this from the start of the shift
+SLOT_STEP_MINUTES = 15
+
+# Longest range the multi-day calendar may request at once
+MAX_RANGE_DAYS = 14
+
+# Resolution of the occupancy bitset
+TICK_MINUTES = 5
+MINUTES_PER_DAY = 24 * 60
+
+
+def to_minutes(t):
+    """Convert a time object to minutes since midnight"""
+    return t.hour * 60 + t.minute
+
+
+def format_minutes(minutes):
+    """Format minutes since midnight as HH:MM"""
+    return f'{minutes // 60:02d}:{minutes % 60:02d}'
+
+
+def service_duration(service):
+    """Minutes a booking of this service blocks"""
+    if service is not None and service.duration:
+        return service.duration
+    return BOOKING_DURATION_MINUTES
+
+
+def booking_duration(booking):
+    """Minutes a stored booking blocks: its end_at - start_at, fixed when it was written"""
+    if booking.start_at is not None and booking.end_at is not None:
+        return int((booking.end_at - booking.start_at).total_seconds() // 60)
+    return service_duration(booking.service)
+
+
+def span_mask(start, end):
+    """Bitmask of the ticks touched by [start, end) minutes, clamped to the day"""
+    end = min(end, MINUTES_PER_DAY)
+    if end <= start:
+        return 0
+    first = start // TICK_MINUTES
+    last = -(-end // TICK_MINUTES)  # round up so partial ticks count as busy
+    return ((1 << (last - first)) - 1) << first
+
+
+class DayOccupancy:
+    """One employee's day: working hours plus booked ticks packed into an int"""
+    __slots__ = ('hours', 'bits', 'count', 'stops')
+
+    def __init__(self, hours=None):
+        self.hours = hours  # (start_min, end_min) or None when off that day
+        self.bits = 0
+        self.count = 0
+        self.stops = []  # (start_min, lat, lng) of bookings with known coordinates
+
+    def add(self, start, duration=BOOKING_DURATION_MINUTES, lat=None, lng=None):
+        self.bits |= span_mask(start, start + duration)
+        self.count += 1
+        if lat is not None and lng is not None:
+            self.stops.append((start, lat, lng))
+
+    def previous_stop(self, start, extra=()):
+        """(lat, lng) of the latest located booking starting before `start`, or None.
+        extra adds (start_min, lat, lng) stops not recorded here (e.g. planned bookings)."""
+        best = None
+        for stop_start, lat, lng in chain(self.stops, extra):
+            if stop_start < start and (best is None or stop_start > best[0]):
+                best = (stop_start, lat, lng)
+        return best[1:] if best else None
+
+    def booked_minutes(self):
+        """Minutes of the day taken by bookings (overlaps counted once)"""
+        return bin(self.bits).count('1') * TICK_MINUTES
+
+    def has_conflict(self, start, duration=BOOKING_DURATION_MINUTES):
+        """True if [start, start + duration) overlaps a booking"""
+        return bool(self.bits & span_mask(start, start + duration))
+
+    def is_free(self, start, duration=BOOKING_DURATION_MINUTES):
+        """True if the slot fits the working hours and overlaps no booking"""
+        if not self.hours:
+            return False
+        if start < self.hours[0] or start + duration > self.hours[1]:
+            return False
+        return not self.has_conflict(start, duration)
+
+    def free_intervals(self):
+        """Free gaps of the shift as [(start_min, end_min)], read straight off the bitset"""
+        if not self.hours:
+            return []
+        first = -(-self.hours[0] // TICK_MINUTES)
+        last = self.hours[1] // TICK_MINUTES
+        if last <= first:
+            return []
+        free = ~self.bits & (((1 << (last - first)) - 1) << first)
+        intervals = []
+        while free:
+            start = (free & -free).bit_length() - 1
+            run = free >> start
+            length = (run ^ (run + 1)).bit_length() - 1
+            intervals.append((max(start * TICK_MINUTES, self.hours[0]), min((start + length) * TICK_MINUTES, self.hours[1])))
+            free &= ~(((1 << length) - 1) << start)
+        return intervals
+
+    def free_slots(self, earliest=None, duration=BOOKING_DURATION_MINUTES, step=SLOT_STEP_MINUTES):
+        """Free slot starts (minutes) on the step grid, taken from the free gaps of the day"""
+        slots = []
+        for gap_start, gap_end in self.free_intervals():
+            if earliest is not None and gap_end <= earliest:
+                continue
+            # First grid point (counted from the shift start) inside the gap
+            offset = gap_start - self.hours[0]
+            current = self.hours[0] + -(-offset // step) * step
+            while current + duration <= gap_end:
+                if earliest is None or current > earliest:
+                    slots.append(current)
+                current += step
+        return slots
+
+
+class EmployeeAvailability:
+    """Occupancy of a set of employees over a date range, built from one bookings query"""
+
+    def __init__(self, schedules, bookings):
+        # {employee_id: {day_of_week: (start_min, end_min)}}, employees in id order
+        self.schedules = schedules
+        # {(employee_id, date): DayOccupancy}
+        self._days = {}
+        for employee_id, start_at, end_at, lat, lng in bookings:
+            if start_at is None:
+                continue
+            duration = int((end_at - start_at).total_seconds() // 60) if end_at else BOOKING_DURATION_MINUTES
+            self.occupancy(employee_id, start_at.date()).add(
+                to_minutes(start_at), duration, lat=lat, lng=lng
+            )
+
+    @classmethod
+    def for_neighborhood(cls, neighborhood_id, date_from, date_to=None):
+        """Employees serving a neighborhood, with their schedules and bookings"""
+        schedules = schedule_cache.for_neighborhood(neighborhood_id)
+        return cls._load(schedules, list(schedules.keys()), date_from, date_to)
+
+    @classmethod
+    def for_employees(cls, employee_ids, date_from, date_to=None, exclude_booking_id=None):
+        """Specific employees, optionally ignoring one booking (e.g. the one being reassigned)"""
+        employee_ids = list(employee_ids)
+        schedules = schedule_cache.for_employees(employee_ids)
+        return cls._load(schedules, employee_ids, date_from, date_to, exclude_booking_id)
+
+    @classmethod
+    def _load(cls, schedules, employee_ids, date_from, date_to=None, exclude_booking_id=None):
+        date_to = date_to or date_from
+
+        bookings = []
+        if employee_ids:
+            # Range scan on the (employee_id, start_at) index
+            query = db.session.query(
+                Booking.employee_id,
+                Booking.start_at,
+                Booking.end_at,
+                Booking.location_lat,
+                Booking.location_lng
+            ).filter(
+                Booking.employee_id.in_(employee_ids),
+                Booking.start_at >= datetime.combine(date_from, datetime.min.time()),
+                Booking.start_at < datetime.combine(date_to + timedelta(days=1), datetime.min.time()),
+                Booking.status.in_(ACTIVE_STATUSES)
+            )
+            if exclude_booking_id:
+                query = query.filter(Booking.id != exclude_booking_id)
+            bookings = query.all()
+
+        return cls(schedules, bookings)
+
+    def employee_ids(self):
+        return list(self.schedules.keys())
+
+    def occupancy(self, employee_id, day):
+        """DayOccupancy for an employee on a date, created on first use"""
+        key = (employee_id, day)
+        occupancy = self._days.get(key)
+        if occupancy is None:
+            hours = self.schedules.get(employee_id, {}).get(day.weekday())
+            occupancy = self._days[key] = DayOccupancy(hours)
+        return occupancy
+
+    def is_free(self, employee_id, day, start, duration=BOOKING_DURATION_MINUTES):
+        return self.occupancy(employee_id, day).is_free(start, duration)
+
+    def employee_slots(self, employee_id, day, now=None, duration=BOOKING_DURATION_MINUTES):
+        """Free slot starts (minutes) for one employee, skipping past times today"""
+        earliest = None
+        if now is not None and day == now.date():
+            earliest = now.hour * 60 + now.minute
+        return self.occupancy(employee_id, day).free_slots(earliest, duration)
+
+    def free_slots(self, day, now=None, duration=BOOKING_DURATION_MINUTES):
+        """Sorted HH:MM slots where at least one employee is free"""
+        all_slots = set()
+        for employee_id in self.schedules:
+            all_slots.update(self.employee_slots(employee_id, day, now, duration))
+        return [format_minutes(m) for m in sorted(all_slots)]
+
+    def available_employee_ids(self, day, start, duration=BOOKING_DURATION_MINUTES):
+        """Ids of employees free for the whole slot, in id order"""
+        return [
+            employee_id for employee_id in self.schedules
+            if self.is_free(employee_id, day, start, duration)
+        ]
+
+
+def _drop_past_slots(slots, day, now):
+    """Remove slots that have already started when the date is today"""
+    if now is None or day != now.date():
+        return slots
+    current = now.strftime('%H:%M')
+    return [slot for slot in slots if slot > current]
+
+
+def get_free_slots(neighborhood_id, day, now=None, duration=BOOKING_DURATION_MINUTES):
+    """Free HH:MM slots across all employees of a neighborhood on a date"""
+    generation = slot_cache.generation
+    slots = slot_cache.get(neighborhood_id, day, duration)
+    if slots is None:
+        availability = EmployeeAvailability.for_neighborhood(neighborhood_id, day)
+        slots = availability.free_slots(day, duration=duration)
+        slot_cache.put(neighborhood_id, day, duration, slots, availability.employee_ids(), generation)
+    return _drop_past_slots(slots, day, now or datetime.now())
+
+
+def get_free_slots_range(neighborhood_id, date_from, date_to, now=None, duration=BOOKING_DURATION_MINUTES):
+    """Free HH:MM slots per date (YYYY-MM-DD) from one bulk fetch, capped at MAX_RANGE_DAYS"""
+    date_to = min(date_to, date_from + timedelta(days=MAX_RANGE_DAYS - 1))
+    if date_to < date_from:
+        return {}
+
+    now = now or datetime.now()
+    days = [date_from + timedelta(days=i) for i in range((date_to - date_from).days + 1)]
+
+    generation = slot_cache.generation
+    slots_by_day = {}
+    missing = []
+    for day in days:
+        slots = slot_cache.get(neighborhood_id, day, duration)
+        if slots is None:
+            missing.append(day)
+        else:
+            slots_by_day[day] = slots
+
+    # One bulk fetch covering every uncached day
+    if missing:
+        availability = EmployeeAvailability.for_neighborhood(neighborhood_id, missing[0], missing[-1])
+        for day in missing:
+            slots_by_day[day] = availability.free_slots(day, duration=duration)
+            slot_cache.put(neighborhood_id, day, duration, slots_by_day[day], availability.employee_ids(), generation)
+
+    return {
+        day.strftime('%Y-%m-%d'): _drop_past_slots(slots_by_day[day], day, now)
+        for day in days
+    }
+
+
+def get_employee_free_slots(employee_id, day, now=None, duration=BOOKING_DURATION_MINUTES, exclude_booking_id=None):
+    """Free HH:MM slots for a single employee on a date"""
+    availability = EmployeeAvailability.for_employees([employee_id], day, exclude_booking_id=exclude_booking_id)
+    slots = availability.employee_slots(employee_id, day, now or datetime.now(), duration)
+    return [format_minutes(m) for m in slots]
+
+
+def employee_has_conflict(employee_id, day, booking_time, exclude_booking_id=None, duration=BOOKING_DURATION_MINUTES):
+    """True if the employee already has an active booking overlapping this slot"""
+    availability = EmployeeAvailability.for_employees([employee_id], day, exclude_booking_id=exclude_booking_id)
+    return availability.occupancy(employee_id, day).has_conflict(to_minutes(booking_time), duration)
@@ -0,0 +1,138 @@
+"""
+Broadcast fan-out.
+"Send to all customers" only records a Broadcast row in the request; this
+background job (see app.jobs) then creates every in-app notification with one
+INSERT ... SELECT, loads all customer devices with one query and pushes to
+them concurrently at a bounded rate, saving progress after every chunk so the
+admin page can poll it and a restarted job resumes where it stopped.
+"""
+import json
+import time
+from datetime import datetime
+from concurrent.futures import wait as wait_futures
+from sqlalchemy import insert, select, update, literal, or_
+from app import db
+from app.models import Broadcast, Notification, PushSubscription, User
+from app.notifications import push_to_subscriptions, push_enabled, apply_delivery_results, PUSH_TIMEOUT_SECONDS
+from app.jobs import acquire_lock
+
+# Job name in job_lock
+BROADCAST_JOB = 'broadcasts'
+
+# Push services throttle bursts; this many deliveries are started per second
+RATE_PER_SECOND = 50
+
+# The job is started with this lease and renews it after every chunk, so a long broadcast keeps it
+LEASE_SECONDS = 60
+
+
+def _create_notifications(broadcast):
+    """In-app notification for every customer in one statement; returns the row count"""
+    rows = select(
+        User.id,
+        literal(broadcast.title),
+        literal(broadcast.message),
+        literal(False),
+        literal(datetime.utcnow())
+    ).where(User.role == 'customer')
+    result = db.session.execute(
+        insert(Notification).from_select(['user_id', 'title', 'message', 'read', 'created_at'], rows)
+    )
+    return result.rowcount
+
+
+def run_broadcast(broadcast):
+    """Fan out one broadcast; safe to call again on a half-finished one"""
+    if broadcast.status == 'queued':
+        # Claim the row before fanning out: a process that finds it no longer queued leaves it
+        # alone, and the notifications commit with the claim, so they are never created twice
+        claimed = db.session.execute(
+            update(Broadcast)
+            .where(Broadcast.id == broadcast.id, Broadcast.status == 'queued')
+            .values(status='running', started_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if not claimed:
+            db.session.rollback()
+            return
+        broadcast.recipients = _create_notifications(broadcast)
+        db.session.commit()
+
+    if not push_enabled():
+        # In-app notifications only
+        broadcast.status = 'done'
+        broadcast.finished_at = datetime.utcnow()
+        db.session.commit()
+        return
+
+    # Every customer device in one query, in a stable order so a restart can skip what was done.
+    # Devices pruned during this broadcast stay in the list, otherwise the resume offset would shift.
+    subscriptions = db.session.query(
+        PushSubscription.id,
+        PushSubscription.endpoint,
+        PushSubscription.p256dh,
+        PushSubscription.auth
+    ).join(
+        User, User.id == PushSubscription.user_id
+    ).filter(
+        User.role == 'customer',
+        or_(PushSubscription.pruned_at.is_(None), PushSubscription.pruned_at >= broadcast.started_at)
+    ).order_by(PushSubscription.id).all()
+
+    broadcast.pushes_total = len(subscriptions)
+    db.session.commit()
+
+    payload = json.dumps({
+        "title": broadcast.title,
+        "body": broadcast.message,
+        "icon": "/static/images/logo.png",
+        "badge": "/static/images/logo.png",
+        "url": "/notifications"
+    })
+
+    done = broadcast.pushes_sent + broadcast.pushes_failed
+    for start in range(done, len(subscriptions), RATE_PER_SECOND):
+        window_start = time.monotonic()
+        futures = push_to_subscriptions(
+            subscriptions[start:start + RATE_PER_SECOND], payload, f'broadcast #{broadcast.id}'
+        )
+        wait_futures(futures, timeout=PUSH_TIMEOUT_SECONDS * 2)
+
+        sent = sum(1 for future in futures if future.done() and future.result() is None)
+        broadcast.pushes_sent += sent
+        broadcast.pushes_failed += len(futures) - sent
+        db.session.commit()
+        apply_delivery_results()
+
+        # Stop if another process took the job over
+        if not acquire_lock(BROADCAST_JOB, LEASE_SECONDS):
+            return
+
+        elapsed = time.monotonic() - window_start
+        if elapsed < 1:
+            time.sleep(1 - elapsed)
+
+    broadcast.status = 'done'
+    broadcast.finished_at = datetime.utcnow()
+    db.session.commit()
+
+
+def run_broadcasts():
+    """Job tick: run pending broadcasts, oldest first"""
+    while True:
+        broadcast = Broadcast.query.filter(
+            Broadcast.status.in_(['queued', 'running'])
+        ).order_by(Broadcast.id).first()
+        if broadcast is None:
+            return
+        try:
+            run_broadcast(broadcast)
+        except Exception as e:
+            db.session.rollback()
+            broadcast.status = 'failed'
+            broadcast.error = str(e)[:500]
+            broadcast.finished_at = datetime.utcnow()
+            db.session.commit()
+            print(f"Broadcast #{broadcast.id} failed: {e}")
+        if broadcast.status == 'running':
+            return  # lease lost mid-way; the new holder continues
@@ -4,49 +4,17 @@ from app import db
 from app.customer import bp
 from app.customer.forms import VehicleForm, BookingForm, EditProfileForm, ChangePasswordForm
 from app.models import Vehicle, Service, Booking, City, Neighborhood, VehicleSize
-
-def check_expired_bookings():
-    """Auto-cancel all bookings (regular and subscription) that haven't been completed within 4 hours"""
-    from datetime import datetime, timedelta
-    from app.models import Subscription
-    from app.utils.timezone import get_saudi_time
-    
-    # Find ALL bookings that are still active (assigned, en_route, arrived, in_progress)
-    # and have passed their scheduled time by more than 4 hours
-    expired_bookings = Booking.query.filter(
-        Booking.status.in_(['assigned', 'en_route', 'arrived', 'in_progress']),
-    ).all()
-    
-    now = get_saudi_time()
-    for booking in expired_bookings:
-        # Calculate booking datetime
-        booking_datetime = datetime.combine(booking.date, booking.time)
-        
-        # Check if 4 hours have passed since the booking time
-        if now.replace(tzinfo=None) > booking_datetime + timedelta(hours=4):
-            # Cancel the booking
-            booking.status = 'cancelled'
-            
-            # If it's a subscription booking, restore the wash
-            if booking.subscription_id and booking.subscription:
-                booking.subscription.remaining_washes += 1
-                # Reactivate subscription if it was expired due to no washes
-                if booking.subscription.status == 'expired' and booking.subscription.remaining_washes > 0:
-                    booking.subscription.status = 'active'
-            
-            db.session.commit()
-            print(f"Auto-cancelled expired booking #{booking.id}")
+from app.availability import get_free_slots, get_free_slots_range, service_duration
+from app.assignment import rank_employees
+from app.reservations import reserve_employee, release_slot
+from app.slot_cache import invalidate_booking
+from app.outbox import enqueue_push
+from app.pricing import price_booking
 
 @bp.before_request
 def before_request():
     if not current_user.is_authenticated or current_user.role != 'customer':
         return redirect(url_for('auth.login'))
-    
-    # Check for expired bookings (regular and subscription)
-    try:
-        check_expired_bookings()
-    except Exception as e:
-        print(f"Error checking expired bookings: {e}")
 
 @bp.route('/')
 def index():
@@ -132,8 +100,9 @@ def cancel_booking(booking_id):
             flash('لا يمكن إلغاء هذا الحجز', 'error')
         return redirect(url_for('customer.my_bookings'))
     
-    # Cancel the booking
+    # Cancel the booking and free the employee's slot
     booking.status = 'cancelled'
+    release_slot(booking)
     
     # Restore wash if this is a subscription booking
     if booking.subscription_id and booking.subscription:
@@ -143,6 +112,7 @@ def cancel_booking(booking_id):
             booking.subscription.status = 'active'
     
     db.session.commit()
+    invalidate_booking(booking)
     
     flash('تم إلغاء الحجز بنجاح', 'success')
     return redirect(url_for('customer.my_bookings'))
@@ -233,6 +203,10 @@ def book():
             neighborhood_id = int(request.form.get('neighborhood_id'))
             service_id = form.service_id.data
             
+            # Car location (optional, shared by the browser) to pick the nearest employee
+            location_lat = request.form.get('location_lat', type=float)
+            location_lng = request.form.get('location_lng', type=float)
+            
             # Check for free wash or discount code (mutual exclusivity)
             use_free_wash = request.form.get('use_free_wash') == 'on'
             discount_code_str = request.form.get('discount_code', '').strip()
@@ -307,59 +281,25 @@ def book():
                 flash('لديك حجز آخر لنفس السيارة في نفس اليوم. الرجاء اختيار يوم آخر أو إلغاء الحجز السابق.')
                 return redirect(url_for('customer.book'))
             
-            employees = neighborhood.employees.filter_by(role='employee').all()
-            available_employee = None
+            # Each booking blocks its service's duration
+            duration = service_duration(Service.query.get(service_id))
+            candidate_ids = rank_employees(neighborhood_id, booking_date, booking_time, duration,
+                                           location=(location_lat, location_lng))
             
-            for employee in employees:
-                # Check if employee has schedule for this day
-                day_of_week = booking_date.weekday()
-                schedule = employee.schedules.filter_by(day_of_week=day_of_week, is_active=True).first()
-                
-                if not schedule:
-                    continue
-                
-                # Check if booking time is within schedule
-                booking_datetime = datetime.combine(booking_date, booking_time)
-                end_datetime = booking_datetime + timedelta(minutes=90)
-                
-                if booking_time < schedule.start_time or end_datetime.time() > schedule.end_time:
-                    continue
-                
-                # Check if employee has conflicting booking (check for time overlap)
-                conflicts = Booking.query.filter(
-                    Booking.employee_id == employee.id,
-                    Booking.date == booking_date,
-                    Booking.status.in_(['pending', 'assigned', 'en_route', 'arrived', 'in_progress'])
-                ).all()
-                
-                has_conflict = False
-                for existing_booking in conflicts:
-                    # Calculate existing booking end time
-                    existing_start = datetime.combine(booking_date, existing_booking.time)
-                    existing_end = existing_start + timedelta(minutes=90)
-                    
-                    # Check for overlap: existing_start < new_end AND existing_end > new_start
-                    if existing_start < end_datetime and existing_end > booking_datetime:
-                        has_conflict = True
-                        break
-                
-                if not has_conflict:
-                    available_employee = employee
-                    break
-            
-            if not available_employee:
+            if not candidate_ids:
                 flash('عذراً، لا يوجد موظفين متاحين في هذا الوقت')
                 return redirect(url_for('customer.book'))
             
-            # Create booking with assigned employee
+            # Create booking; the employee is set once their slot is claimed
             booking = Booking(
                 customer_id=current_user.id,
-                employee_id=available_employee.id,
                 vehicle_id=form.vehicle_id.data,
                 service_id=form.service_id.data,
                 neighborhood_id=neighborhood_id,
                 date=booking_date,
                 time=booking_time,
+                location_lat=location_lat,
+                location_lng=location_lng,
                 status='assigned',
                 discount_code_id=discount_code.id if discount_code else None,
                 used_free_wash=use_free_wash,
@@ -372,7 +312,14 @@ def book():
             if vehicle and vehicle.size:
                 booking.vehicle_size_price = vehicle.size.price_adjustment
             db.session.add(booking)
-            db.session.flush()  # Get booking ID before adding products
+            db.session.flush()  # Get booking ID before claiming the slot and adding products
+            
+            # Atomically claim the slot for the least loaded employee; if another request won it, fall through to the next
+            if not reserve_employee(booking, candidate_ids, duration):
+                db.session.rollback()
+                flash('عذراً، لا يوجد موظفين متاحين في هذا الوقت')
+                return redirect(url_for('customer.book'))
+            available_employee = booking.employee
             
             # Handle product selections
             from app.models import BookingProduct, Product
@@ -389,6 +336,9 @@ def book():
                     )
                     db.session.add(booking_product)
             
+            # Final price, stored on the booking
+            price_booking(booking)
+            
             # Apply free wash or discount
             if use_free_wash:
                 current_user.free_washes -= 1
@@ -398,25 +348,22 @@ def book():
                 discount_code.used_count += 1
                 flash(f'تم تطبيق كود الخصم: {discount_code.code}')
             
-            db.session.commit()
-            
-            # Notify assigned employee
+            # Notify assigned employee (queued in the same transaction, sent after commit)
             if available_employee:
-                try:
-                    from app.notifications import send_push_notification
-                    notification_data = {
-                        "title": "حجز جديد تم تعيينه لك 🆕",
-                        "body": f"تم تعيين حجز جديد #{booking.id}\nالعميل: {current_user.username}\nالخدمة: {booking.service.name_ar}\nالموعد: {booking.date} {booking.time.strftime('%H:%M')}",
-                        "icon": "/static/images/logo.png",
-                        "badge": "/static/images/logo.png",
-                        "url": "/employee/bookings/active",
-                        "data": {
-                            "booking_id": booking.id
-                        }
+                notification_data = {
+                    "title": "حجز جديد تم تعيينه لك 🆕",
+                    "body": f"تم تعيين حجز جديد #{booking.id}\nالعميل: {current_user.username}\nالخدمة: {booking.service.name_ar}\nالموعد: {booking.date} {booking.time.strftime('%H:%M')}",
+                    "icon": "/static/images/logo.png",
+                    "badge": "/static/images/logo.png",
+                    "url": "/employee/bookings/active",
+                    "data": {
+                        "booking_id": booking.id
                     }
-                    send_push_notification(available_employee, notification_data)
-                except Exception as e:
-                    print(f"Failed to send notification to employee: {e}")
+                }
+                enqueue_push(available_employee.id, notification_data)
+            
+            db.session.commit()
+            invalidate_booking(booking)
             flash('تم الحجز بنجاح!')
             return redirect(url_for('customer.booking_success'))
 
@@ -543,101 +490,45 @@ def verify_discount():
 
 @bp.route('/api/available-times')
 def get_available_times():
-    from datetime import datetime, timedelta, time as dt_time
-    from app.models import User, EmployeeSchedule
+    from datetime import datetime, date
     
     # Get query parameters
     date_str = request.args.get('date')
     neighborhood_id = request.args.get('neighborhood_id', type=int)
     service_id = request.args.get('service_id', type=int)
     
+    # Range mode: ?from=YYYY-MM-DD&to=YYYY-MM-DD returns {date: [slots]} for up to 14 days
+    from_str = request.args.get('from')
+    to_str = request.args.get('to')
+    if from_str and to_str:
+        if not all([neighborhood_id, service_id]):
+            return jsonify({})
+        try:
+            date_from = datetime.strptime(from_str, '%Y-%m-%d').date()
+            date_to = datetime.strptime(to_str, '%Y-%m-%d').date()
+        except ValueError:
+            return jsonify({})
+        
+        # Past dates have no bookable slots
+        date_from = max(date_from, date.today())
+        duration = service_duration(Service.query.get(service_id))
+        return jsonify(get_free_slots_range(neighborhood_id, date_from, date_to, datetime.now(), duration))
+    
     if not all([date_str, neighborhood_id, service_id]):
         return jsonify([])
     
     try:
         booking_date = datetime.strptime(date_str, '%Y-%m-%d').date()
-        day_of_week = booking_date.weekday()  # 0=Monday, 6=Sunday
     except ValueError:
         return jsonify([])
     
     # Prevent booking dates in the past
-    from datetime import date as date_class
-    today = date_class.today()
-    if booking_date < today:
-        return jsonify([])
-    
-    # Fixed duration: 90 minutes per booking
-    duration_minutes = 90
-    
-    # Find employees assigned to this neighborhood
-    neighborhood = Neighborhood.query.get(neighborhood_id)
-    if not neighborhood:
-        return jsonify([])
-    
-    
-    employees = neighborhood.employees.filter_by(role='employee').all()
-    
-    if not employees:
+    if booking_date < date.today():
         return jsonify([])
     
-    # Collect all available slots from all employees
-    all_slots = set()
-    
-    # Get current time if booking for today
-    now = datetime.now()
-    is_today = booking_date == today
-    
-    for employee in employees:
-        # Get employee's schedule for this day
-        schedule = employee.schedules.filter_by(day_of_week=day_of_week, is_active=True).first()
-        
-        if not schedule:
-            continue
-        
-        # Generate potential time slots
-        current_time = datetime.combine(booking_date, schedule.start_time)
-        end_time = datetime.combine(booking_date, schedule.end_time)
-        
-        # If booking for today, skip past times
-        if is_today and current_time < now:
-            # Round up to next 30-minute slot
-            minutes_to_add = (30 - now.minute % 30) % 30
-            current_time = now + timedelta(minutes=minutes_to_add)
-            current_time = datetime.combine(booking_date, current_time.time())
-        
-        while current_time + timedelta(minutes=duration_minutes) <= end_time:
-            slot_start = current_time.time()
-            slot_end = (current_time + timedelta(minutes=duration_minutes)).time()
-            
-            # Check if this slot conflicts with existing bookings
-            conflicts = Booking.query.filter(
-                Booking.employee_id == employee.id,
-                Booking.date == booking_date,
-                Booking.status.in_(['pending', 'assigned', 'en_route', 'arrived', 'in_progress'])
-            ).all()
-            
-            has_conflict = False
-            for booking in conflicts:
-                # Calculate existing booking end time (booking start + 90 minutes)
-                booking_start = datetime.combine(booking_date, booking.time)
-                booking_end = booking_start + timedelta(minutes=90)
-                
-                # Check for overlap
-                new_slot_start = datetime.combine(booking_date, slot_start)
-                new_slot_end = datetime.combine(booking_date, slot_end)
-                
-                if booking_start < new_slot_end and booking_end > new_slot_start:
-                    has_conflict = True
-                    break
-            
-            if not has_conflict:
-                all_slots.add(slot_start.strftime('%H:%M'))
-            
-            current_time += timedelta(minutes=90)  # 90-minute intervals
-    
-    # Sort and return
-    sorted_slots = sorted(list(all_slots))
-    return jsonify(sorted_slots)
+    # Schedules and bookings are loaded in bulk, slots computed in memory
+    duration = service_duration(Service.query.get(service_id))
+    return jsonify(get_free_slots(neighborhood_id, booking_date, datetime.now(), duration))
 
 # --- Subscription System ---
 from app.models import SubscriptionPackage, Subscription
@@ -791,52 +682,15 @@ def book_subscription_wash(subscription_id):
             flash('الحي غير محدد في الاشتراك', 'error')
             return redirect(url_for('customer.book_subscription_wash', subscription_id=subscription_id))
         
-        employees = neighborhood.employees.filter_by(role='employee').all()
-        available_employee = None
+        candidate_ids = rank_employees(neighborhood.id, booking_date, booking_time, service_duration(default_service))
         
-        for employee in employees:
-            # Check if employee has schedule for this day
-            day_of_week = booking_date.weekday()
-            schedule = employee.schedules.filter_by(day_of_week=day_of_week, is_active=True).first()
-            
-            if not schedule:
-                continue
-            
-            # Check if booking time is within schedule
-            booking_datetime = datetime.combine(booking_date, booking_time)
-            end_datetime = booking_datetime + timedelta(minutes=90)
-            
-            if booking_time < schedule.start_time or end_datetime.time() > schedule.end_time:
-                continue
-            
-            # Check for conflicts with existing bookings
-            conflicts = Booking.query.filter(
-                Booking.employee_id == employee.id,
-                Booking.date == booking_date,
-                Booking.status.in_(['pending', 'assigned', 'en_route', 'arrived', 'in_progress'])
-            ).all()
-            
-            has_conflict = False
-            for existing_booking in conflicts:
-                existing_start = datetime.combine(booking_date, existing_booking.time)
-                existing_end = existing_start + timedelta(minutes=90)
-                
-                if existing_start < end_datetime and existing_end > booking_datetime:
-                    has_conflict = True
-                    break
-            
-            if not has_conflict:
-                available_employee = employee
-                break
-        
-        if not available_employee:
+        if not candidate_ids:
             flash('عذراً، لا يوجد موظفين متاحين في هذا الوقت', 'error')
             return redirect(url_for('customer.book_subscription_wash', subscription_id=subscription_id))
         
         # Create booking linked to subscription
         booking = Booking(
             customer_id=current_user.id,
-            employee_id=available_employee.id,
             vehicle_id=subscription.vehicle_id,
             service_id=default_service.id if default_service else None,
             neighborhood_id=subscription.neighborhood_id,
@@ -850,33 +704,41 @@ def book_subscription_wash(subscription_id):
         )
         
         db.session.add(booking)
+        db.session.flush()
+        
+        # Atomically claim the slot for the least loaded employee; if another request won it, fall through to the next
+        if not reserve_employee(booking, candidate_ids):
+            db.session.rollback()
+            flash('عذراً، لا يوجد موظفين متاحين في هذا الوقت', 'error')
+            return redirect(url_for('customer.book_subscription_wash', subscription_id=subscription_id))
+        available_employee = booking.employee
+        
+        # Covered by the subscription: the price snapshot records the service value as discount
+        price_booking(booking)
         
         # Decrement remaining washes
         subscription.remaining_washes -= 1
         if subscription.remaining_washes == 0:
             subscription.status = 'expired'
         
-        db.session.commit()
+        # Notify employee (queued in the same transaction, sent after commit)
+        notification_data = {
+            "title": "حجز جديد (اشتراك) 🆕",
+            "body": f"حجز جديد #{booking.id}\nالعميل: {current_user.username}\nالموعد: {booking.date} {booking.time.strftime('%H:%M')}",
+            "icon": "/static/images/logo.png",
+            "badge": "/static/images/logo.png",
+            "url": "/employee/bookings/active",
+            "data": {"booking_id": booking.id}
+        }
+        enqueue_push(available_employee.id, notification_data)
         
-        # Notify employee
-        try:
-            from app.notifications import send_push_notification
-            notification_data = {
-                "title": "حجز جديد (اشتراك) 🆕",
-                "body": f"حجز جديد #{booking.id}\nالعميل: {current_user.username}\nالموعد: {booking.date} {booking.time.strftime('%H:%M')}",
-                "icon": "/static/images/logo.png",
-                "badge": "/static/images/logo.png",
-                "url": "/employee/bookings/active",
-                "data": {"booking_id": booking.id}
-            }
-            send_push_notification(available_employee, notification_data)
-        except Exception as e:
-            print(f"Failed to send notification: {e}")
+        db.session.commit()
+        invalidate_booking(booking)
         
         flash('تم حجز الغسلة بنجاح!', 'success')
         return redirect(url_for('customer.subscriptions'))
     
-    return render_template('customer/book_subscription_wash.html', subscription=subscription)
+    return render_template('customer/book_subscription_wash.html', subscription=subscription, default_service=default_service)
 
 @bp.route('/loyalty')
 def loyalty():
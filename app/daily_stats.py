@@ -0,0 +1,212 @@
+"""
+Daily booking rollup.
+DailyStats holds booking counts and revenue per (date, city, neighborhood,
+employee, service, payment method). Every booking insert, update and delete
+moves the booking's contribution between rollup rows inside the same
+transaction, so reports, dashboards and statistics pages read a few
+pre-aggregated rows instead of scanning bookings. `flask rebuild-daily-stats`
+recomputes it from the bookings table, e.g. after a backfill or a bulk edit
+made outside the ORM.
+"""
+from sqlalchemy import and_, case, delete, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import Booking, DailyStats, Neighborhood
+
+KEY = ('date', 'city_id', 'neighborhood_id', 'employee_id', 'service_id', 'payment_method')
+MEASURES = ('bookings', 'completed', 'cancelled', 'revenue', 'service_revenue', 'products_revenue', 'discount')
+
+# Booking columns that decide its rollup row and what it adds there
+TRACKED = ('date', 'neighborhood_id', 'employee_id', 'service_id', 'payment_method', 'status',
+           'service_amount', 'products_amount', 'discount_amount', 'total_amount')
+
+
+def _city_id(connection, neighborhood_id):
+    if not neighborhood_id:
+        return 0
+    return connection.execute(
+        select(Neighborhood.city_id).where(Neighborhood.id == neighborhood_id)
+    ).scalar() or 0
+
+
+def _contribution(connection, values):
+    """(key, measures) a booking with these column values adds to the rollup; None without a date"""
+    if values['date'] is None:
+        return None
+    key = (
+        values['date'],
+        _city_id(connection, values['neighborhood_id']),
+        values['neighborhood_id'] or 0,
+        values['employee_id'] or 0,
+        values['service_id'] or 0,
+        values['payment_method'] or ''
+    )
+    measures = {'bookings': 1}
+    if values['status'] == 'cancelled':
+        measures['cancelled'] = 1
+    elif values['status'] == 'completed':
+        measures['completed'] = 1
+        measures['revenue'] = values['total_amount'] or 0
+        measures['service_revenue'] = (values['service_amount'] or 0) - (values['discount_amount'] or 0)
+        measures['products_revenue'] = values['products_amount'] or 0
+        measures['discount'] = values['discount_amount'] or 0
+    return key, measures
+
+
+def apply_delta(connection, key, measures, sign=1):
+    """Add (sign=1) or take away (sign=-1) measures on one rollup row, creating the row if
+    needed and deleting it once its last booking has been taken away"""
+    where = and_(*(getattr(DailyStats, name) == value for name, value in zip(KEY, key)))
+    changes = {
+        name: getattr(DailyStats, name) + sign * measures[name]
+        for name in MEASURES if measures.get(name)
+    }
+    if not changes:
+        return
+    if connection.execute(update(DailyStats).where(where).values(changes)).rowcount:
+        if sign < 0 and measures.get('bookings'):
+            # E.g. the employee_id=0 row an unassigned booking leaves behind once it is assigned
+            connection.execute(delete(DailyStats).where(where, DailyStats.bookings <= 0))
+        return
+    try:
+        with connection.begin_nested():
+            row = dict(zip(KEY, key))
+            row.update({name: sign * measures.get(name, 0) for name in MEASURES})
+            connection.execute(insert(DailyStats).values(row))
+    except IntegrityError:
+        # Another transaction created the row first
+        connection.execute(update(DailyStats).where(where).values(changes))
+
+
+def _old_values(target):
+    """Tracked column values as last written to or loaded from the database"""
+    state = db.inspect(target)
+    written = state.info.get('rollup_values', {})
+    values = {}
+    for name in TRACKED:
+        history = state.attrs[name].history
+        if history.deleted:
+            values[name] = history.deleted[0]
+        elif history.has_changes() and name in written:
+            # Changed right after this session inserted or updated it: nothing was loaded to compare with
+            values[name] = written[name]
+        else:
+            values[name] = getattr(target, name)
+    return values
+
+
+def _current_values(target):
+    values = {name: getattr(target, name) for name in TRACKED}
+    db.inspect(target).info['rollup_values'] = values
+    return values
+
+
+@db.event.listens_for(Booking, 'after_insert')
+def _booking_inserted(mapper, connection, target):
+    new = _contribution(connection, _current_values(target))
+    if new:
+        apply_delta(connection, *new)
+
+
+@db.event.listens_for(Booking, 'after_update')
+def _booking_updated(mapper, connection, target):
+    state = db.inspect(target)
+    if not any(state.attrs[name].history.has_changes() for name in TRACKED):
+        return
+    old = _contribution(connection, _old_values(target))
+    new = _contribution(connection, _current_values(target))
+    if old:
+        apply_delta(connection, *old, sign=-1)
+    if new:
+        apply_delta(connection, *new)
+
+
+@db.event.listens_for(Booking, 'after_delete')
+def _booking_deleted(mapper, connection, target):
+    old = _contribution(connection, _old_values(target))
+    if old:
+        apply_delta(connection, *old, sign=-1)
+
+
+# Load the previous value when a tracked column is assigned on an expired booking,
+# otherwise the update handler could not tell which row to take the booking out of
+def _keep_history(target, value, oldvalue, initiator):
+    return value
+
+
+for _name in TRACKED:
+    db.event.listen(getattr(Booking, _name), 'set', _keep_history, active_history=True, retval=True)
+
+
+def cancel_in_rollup(booking_filter):
+    """Move the bookings matching a SQL condition from open to cancelled, for bulk
+    status updates that bypass the ORM (see app.expiry); call before the UPDATE."""
+    connection = db.session.connection()
+    groups = connection.execute(
+        select(
+            Booking.date,
+            func.coalesce(Neighborhood.city_id, 0),
+            func.coalesce(Booking.neighborhood_id, 0),
+            func.coalesce(Booking.employee_id, 0),
+            func.coalesce(Booking.service_id, 0),
+            func.coalesce(Booking.payment_method, ''),
+            func.count(Booking.id)
+        ).select_from(Booking).outerjoin(
+            Neighborhood, Neighborhood.id == Booking.neighborhood_id
+        ).where(
+            booking_filter, Booking.date.isnot(None)
+        ).group_by(
+            Booking.date, Neighborhood.city_id, Booking.neighborhood_id, Booking.employee_id,
+            Booking.service_id, Booking.payment_method
+        )
+    ).all()
+    for *key, count in groups:
+        apply_delta(connection, tuple(key), {'cancelled': count})
+
+
+def rebuild_daily_stats(from_date=None, to_date=None):
+    """Recompute the rollup for a date range (or everything) from bookings with one
+    INSERT ... SELECT; returns the number of rollup rows written"""
+    booking_range = [Booking.date.isnot(None)]
+    stats_range = []
+    if from_date:
+        booking_range.append(Booking.date >= from_date)
+        stats_range.append(DailyStats.date >= from_date)
+    if to_date:
+        booking_range.append(Booking.date <= to_date)
+        stats_range.append(DailyStats.date <= to_date)
+
+    completed = Booking.status == 'completed'
+    dimensions = (
+        Booking.date,
+        func.coalesce(Neighborhood.city_id, 0),
+        func.coalesce(Booking.neighborhood_id, 0),
+        func.coalesce(Booking.employee_id, 0),
+        func.coalesce(Booking.service_id, 0),
+        func.coalesce(Booking.payment_method, '')
+    )
+    rows = select(
+        *dimensions,
+        func.count(Booking.id),
+        func.sum(case((completed, 1), else_=0)),
+        func.sum(case((Booking.status == 'cancelled', 1), else_=0)),
+        func.sum(case((completed, Booking.total_amount), else_=0)),
+        func.sum(case((completed, Booking.service_amount - Booking.discount_amount), else_=0)),
+        func.sum(case((completed, Booking.products_amount), else_=0)),
+        func.sum(case((completed, Booking.discount_amount), else_=0))
+    ).select_from(Booking).outerjoin(
+        Neighborhood, Neighborhood.id == Booking.neighborhood_id
+    ).where(*booking_range).group_by(*dimensions)
+
+    db.session.execute(delete(DailyStats).where(*stats_range))
+    written = db.session.execute(insert(DailyStats).from_select(list(KEY + MEASURES), rows)).rowcount
+    db.session.commit()
+    return written
+
+
+def stats_totals(*filters):
+    """Sum of every measure over the rollup rows matching `filters` (DailyStats columns)"""
+    row = db.session.query(
+        *(func.coalesce(func.sum(getattr(DailyStats, name)), 0) for name in MEASURES)
+    ).filter(*filters).one()
+    return dict(zip(MEASURES, row))
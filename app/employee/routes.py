@@ -5,45 +5,12 @@ from app import db
 from app.employee import bp
 from app.models import Booking, User, Subscription
 from datetime import datetime, date, timedelta
-from app.notifications import send_push_notification
-
-def check_expired_bookings():
-    """Auto-cancel all bookings (regular and subscription) that haven't been completed within 4 hours"""
-    from app.utils.timezone import get_saudi_time
-    # Find ALL bookings that are still active
-    expired_bookings = Booking.query.filter(
-        Booking.status.in_(['assigned', 'en_route', 'arrived', 'in_progress']),
-    ).all()
-    
-    now = get_saudi_time()
-    for booking in expired_bookings:
-        # Calculate booking datetime
-        booking_datetime = datetime.combine(booking.date, booking.time)
-        
-        # Check if 4 hours have passed since the booking time
-        if now.replace(tzinfo=None) > booking_datetime + timedelta(hours=4):
-            # Cancel the booking
-            booking.status = 'cancelled'
-            
-            # If it's a subscription booking, restore the wash
-            if booking.subscription_id and booking.subscription:
-                booking.subscription.remaining_washes += 1
-                if booking.subscription.status == 'expired' and booking.subscription.remaining_washes > 0:
-                    booking.subscription.status = 'active'
-            
-            db.session.commit()
-            print(f"Auto-cancelled expired booking #{booking.id}")
+from app.outbox import enqueue_push
 
 @bp.before_request
 def before_request():
     if not current_user.is_authenticated or current_user.role != 'employee':
         return redirect(url_for('auth.login'))
-    
-    # Check for expired bookings (regular and subscription)
-    try:
-        check_expired_bookings()
-    except Exception as e:
-        print(f"Error checking expired bookings: {e}")
 
 @bp.route('/set-language/<lang>')
 def set_language(lang):
@@ -140,12 +107,8 @@ def update_status(id, status):
             
             flash(f'تم تحديث الحالة بنجاح', 'success')
             
-            # Send notification to customer with Arabic message
+            # Notify customer with Arabic message (queued in the same transaction, sent after commit)
             if status in status_messages:
-                print(f"🔔 Attempting to send {status} notification to customer {booking.customer.username}")
-                if not booking.customer.push_subscriptions:
-                    print(f"⚠️ Customer {booking.customer.username} has NO push subscriptions!")
-                
                 notification_data = {
                     "title": status_messages[status]['title'],
                     "body": status_messages[status]['body'],
@@ -157,8 +120,7 @@ def update_status(id, status):
                         "status": status
                     }
                 }
-                success = send_push_notification(booking.customer, notification_data)
-                print(f"🔔 Notification sent result: {success}")
+                enqueue_push(booking.customer_id, notification_data)
             
         db.session.commit()
         
@@ -173,17 +135,17 @@ def update_status(id, status):
                     created_at=datetime.utcnow()
                 )
                 db.session.add(notification)
-                db.session.commit()
                 
                 # Push notification
-                send_push_notification(
-                    booking.customer,
+                enqueue_push(
+                    booking.customer_id,
                     {
                         "title": 'تم الانتهاء من الغسيل! 🌟',
                         "body": 'نأمل أن تكون راضياً عن خدمتنا. يرجى تقييم تجربتك.',
                         "url": url_for('customer.rate_booking', booking_id=booking.id, _external=True)
                     }
                 )
+                db.session.commit()
             except Exception as e:
                 print(f"Error sending rating notification: {e}")
     
@@ -258,23 +220,8 @@ def history():
 @bp.route('/stats')
 def stats():
     """Show employee statistics"""
-    # Total bookings
-    total_bookings = Booking.query.filter_by(employee_id=current_user.id).count()
-    
-    # Completed bookings
-    completed_bookings = Booking.query.filter_by(
-        employee_id=current_user.id,
-        status='completed'
-    ).count()
-    
-    # Completion rate
-    completion_rate = (completed_bookings / total_bookings * 100) if total_bookings > 0 else 0
-    
-    # Get completed bookings list for calculations
-    completed_booking_list = Booking.query.filter_by(
-        employee_id=current_user.id,
-        status='completed'
-    ).all()
+    from sqlalchemy import func, extract, case
+    from app.models import BookingProduct
     
     # Active subscriptions
     active_subscriptions = Subscription.query.filter_by(
@@ -282,65 +229,51 @@ def stats():
         status='active'
     ).count()
     
-    # Pending bookings
-    pending_bookings = Booking.query.filter(
-        Booking.employee_id == current_user.id,
-        Booking.status.in_(['assigned', 'en_route', 'arrived', 'in_progress'])
-    ).count()
-    
-    # Total earnings (sum of completed bookings with accurate pricing)
-    total_earnings = 0
-    
-    # Calculate product stats
-    total_products_sold = 0
-    total_products_revenue = 0
-    total_services_revenue = 0
+    # Product units per booking, joined into the aggregate below
+    units = db.session.query(
+        BookingProduct.booking_id,
+        func.sum(BookingProduct.quantity).label('quantity')
+    ).group_by(BookingProduct.booking_id).subquery()
+    
+    # Counts and earnings per month in one grouped query over the employee's bookings;
+    # earnings come from the price snapshot stored on each booking
+    completed = Booking.status == 'completed'
+    year = extract('year', Booking.date)
+    month = extract('month', Booking.date)
+    rows = db.session.query(
+        year,
+        month,
+        func.count(Booking.id),
+        func.sum(case((completed, 1), else_=0)),
+        func.sum(case((Booking.status.in_(['assigned', 'en_route', 'arrived', 'in_progress']), 1), else_=0)),
+        func.sum(case((completed, Booking.total_amount), else_=0)),
+        func.sum(case((completed, Booking.service_amount - Booking.discount_amount), else_=0)),
+        func.sum(case((completed, Booking.products_amount), else_=0)),
+        func.sum(case((completed, units.c.quantity), else_=0))
+    ).outerjoin(
+        units, units.c.booking_id == Booking.id
+    ).filter(
+        Booking.employee_id == current_user.id
+    ).group_by(year, month).all()
     
-    for booking in completed_booking_list:
-        # Calculate service price after discount/free wash
-        service_price = booking.service.price if booking.service else 0
-        discount_amount = 0
-        
-        # Check if free wash was used
-        if booking.used_free_wash:
-            service_price = 0
-        # Check if discount code was applied
-        elif booking.discount_code:
-            if booking.discount_code.discount_type == 'percentage':
-                discount_amount = service_price * (booking.discount_code.value / 100)
-            else:
-                discount_amount = booking.discount_code.value
-        
-        # Calculate final service price (including vehicle size price)
-        final_service_price = service_price - discount_amount + (booking.vehicle_size_price or 0)
-        total_services_revenue += final_service_price
-        
-        # Calculate products total
-        products_total = sum([bp.product.price * bp.quantity for bp in booking.products])
-        
-        # Add to total earnings
-        total_earnings += final_service_price + products_total
-        
-        # Update product stats
-        for bp in booking.products:
-            total_products_sold += bp.quantity
-            total_products_revenue += (bp.product.price * bp.quantity)
-
-    # Monthly data calculation remains the same...
-    from sqlalchemy import func, extract
     current_year = datetime.now().year
+    total_bookings = completed_bookings = pending_bookings = 0
+    total_earnings = total_services_revenue = total_products_revenue = total_products_sold = 0
+    # Monthly completed bookings of the current year, for the chart
+    monthly_data = {}
+    for row_year, row_month, count, done, pending, earnings, services_revenue, products_revenue, products_sold in rows:
+        total_bookings += count
+        completed_bookings += done or 0
+        pending_bookings += pending or 0
+        total_earnings += earnings or 0
+        total_services_revenue += services_revenue or 0
+        total_products_revenue += products_revenue or 0
+        total_products_sold += products_sold or 0
+        if row_year is not None and int(row_year) == current_year and done:
+            monthly_data[int(row_month)] = done
     
-    monthly_completed = db.session.query(
-        extract('month', Booking.date).label('month'),
-        func.count(Booking.id).label('count')
-    ).filter(
-        Booking.employee_id == current_user.id,
-        Booking.status == 'completed',
-        extract('year', Booking.date) == current_year
-    ).group_by('month').all()
-    
-    # Convert to dict for easy template access
-    monthly_data = {int(month): count for month, count in monthly_completed}
+    # Completion rate
+    completion_rate = (completed_bookings / total_bookings * 100) if total_bookings > 0 else 0
     
     return render_template('employee/stats.html',
                          total_bookings=total_bookings,
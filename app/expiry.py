@@ -0,0 +1,85 @@
+"""
+Expiry of overdue bookings.
+Bookings still active 4 hours after their scheduled time are cancelled by the
+background sweeper (see app.jobs) rather than on every customer/employee page view.
+The whole sweep is a handful of set-based statements in one transaction, so a
+backlog of stale bookings costs the same as a single one.
+"""
+from datetime import timedelta
+from sqlalchemy import and_, case, func, select, update, delete
+from app import db
+from app.models import Booking, Subscription, SlotClaim
+from app.daily_stats import cancel_in_rollup
+from app.report_cache import invalidate_reports
+from app.slot_cache import slot_cache
+from app.utils.timezone import get_saudi_time
+
+# Job name in job_lock
+SWEEPER_JOB = 'expire_bookings'
+
+# How long after its start time an unfinished booking is cancelled
+EXPIRY_HOURS = 4
+
+# Statuses that can still expire
+EXPIRABLE_STATUSES = ['assigned', 'en_route', 'arrived', 'in_progress']
+
+
+def overdue_filter(now=None):
+    """SQL condition for active bookings that started more than EXPIRY_HOURS ago"""
+    now = now or get_saudi_time().replace(tzinfo=None)
+    cutoff = now - timedelta(hours=EXPIRY_HOURS)
+    # Range scan on the (status, start_at) index
+    return and_(
+        Booking.status.in_(EXPIRABLE_STATUSES),
+        Booking.start_at < cutoff
+    )
+
+
+def check_expired_bookings(now=None):
+    """Auto-cancel all bookings (regular and subscription) that haven't been completed within 4 hours.
+    Returns {'bookings': cancelled count, 'subscriptions': subscriptions given washes back}."""
+    overdue = overdue_filter(now)
+    overdue_ids = select(Booking.id).where(overdue)
+
+    # Days whose free slots change, for the cache (before the statuses flip)
+    affected = db.session.query(Booking.employee_id, Booking.neighborhood_id, Booking.date).filter(overdue).distinct().all()
+    if not affected:
+        return {'bookings': 0, 'subscriptions': 0}
+
+    # Give each subscription back one wash per expired booking and reactivate it
+    restored = select(func.count(Booking.id)).where(
+        Booking.subscription_id == Subscription.id,
+        overdue
+    ).scalar_subquery()
+    subscriptions = db.session.execute(
+        update(Subscription)
+        .where(Subscription.id.in_(select(Booking.subscription_id).where(overdue, Booking.subscription_id.isnot(None))))
+        .values(
+            remaining_washes=func.coalesce(Subscription.remaining_washes, 0) + restored,
+            status=case((Subscription.status == 'expired', 'active'), else_=Subscription.status)
+        )
+        .execution_options(synchronize_session=False)
+    ).rowcount
+
+    # Free the employees' slots, then cancel the bookings (the bulk UPDATE skips the rollup listeners)
+    db.session.execute(
+        delete(SlotClaim).where(SlotClaim.booking_id.in_(overdue_ids)).execution_options(synchronize_session=False)
+    )
+    cancel_in_rollup(overdue)
+    bookings = db.session.execute(
+        update(Booking).where(overdue).values(status='cancelled').execution_options(synchronize_session=False)
+    ).rowcount
+
+    db.session.commit()
+
+    for employee_id, neighborhood_id, day in affected:
+        slot_cache.invalidate_employee(employee_id, day)
+        slot_cache.invalidate_neighborhood(neighborhood_id, day)
+    if subscriptions:
+        # Reactivated subscriptions count in reports by their start date, which is not loaded here
+        invalidate_reports()
+    else:
+        invalidate_reports({day for _, _, day in affected})
+
+    print(f"Auto-cancelled {bookings} expired bookings, restored washes on {subscriptions} subscriptions")
+    return {'bookings': bookings, 'subscriptions': subscriptions}
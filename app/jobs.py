@@ -0,0 +1,91 @@
+"""
+Background jobs.
+Periodic work (expiring overdue bookings, ...) runs in a daemon thread started
+with the app instead of inside requests. Every worker process starts the thread,
+but each tick first takes a lease row in job_lock, so only one process in the
+whole deployment actually runs the job; if that process dies its lease expires
+and another one takes over.
+"""
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import insert, update, or_
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import JobLock
+
+# Identifies this process as a lease holder
+HOLDER = f'{socket.gethostname()}:{os.getpid()}'
+
+_started = set()
+_started_lock = threading.Lock()
+
+
+def acquire_lock(name, ttl_seconds):
+    """Take or renew the lease on a job; returns True if this process holds it"""
+    now = datetime.utcnow()
+    expires_at = now + timedelta(seconds=ttl_seconds)
+
+    # Renew our own lease or take over an expired one
+    result = db.session.execute(
+        update(JobLock)
+        .where(JobLock.name == name, or_(JobLock.holder == HOLDER, JobLock.expires_at < now))
+        .values(holder=HOLDER, expires_at=expires_at)
+    )
+    if result.rowcount:
+        db.session.commit()
+        return True
+
+    # First run ever: the primary key decides who creates the row
+    savepoint = db.session.begin_nested()
+    try:
+        db.session.execute(insert(JobLock).values(name=name, holder=HOLDER, expires_at=expires_at))
+        savepoint.commit()
+    except IntegrityError:
+        savepoint.rollback()
+        db.session.rollback()
+        return False
+    db.session.commit()
+    return True
+
+
+def release_lock(name):
+    """Give up the lease early (e.g. on shutdown) so another process can take over"""
+    JobLock.query.filter_by(name=name, holder=HOLDER).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def run_job(app, name, func, ttl_seconds):
+    """Run one tick of a job if this process holds its lease"""
+    with app.app_context():
+        try:
+            if acquire_lock(name, ttl_seconds):
+                func()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Background job {name} failed: {e}")
+        finally:
+            db.session.remove()
+
+
+def start_periodic(app, name, interval_seconds, func, ttl_seconds=None):
+    """Run func every interval_seconds in a daemon thread (once per process).
+    ttl_seconds must outlast one run of func, unless func renews the lease itself."""
+    with _started_lock:
+        if name in _started:
+            return
+        _started.add(name)
+
+    # By default the lease outlives a couple of missed ticks before another process takes over
+    ttl_seconds = ttl_seconds or interval_seconds * 3
+
+    def loop():
+        while True:
+            run_job(app, name, func, ttl_seconds)
+            time.sleep(interval_seconds)
+
+    thread = threading.Thread(target=loop, name=f'job-{name}', daemon=True)
+    thread.start()
+    return thread
@@ -87,6 +87,15 @@ def subscribe():
         # Check if subscription already exists
         existing = PushSubscription.query.filter_by(endpoint=subscription_info['endpoint']).first()
         if existing:
+            # Browser subscribed again with a pruned endpoint: take the new keys and use it again
+            if existing.pruned_at is not None:
+                existing.user_id = current_user.id
+                existing.p256dh = subscription_info['keys']['p256dh']
+                existing.auth = subscription_info['keys']['auth']
+                existing.pruned_at = None
+                existing.failure_count = 0
+                db.session.commit()
+                return jsonify({'status': 'updated'}), 200
             # Update user_id if account changed (important for account switching)
             if existing.user_id != current_user.id:
                 existing.user_id = current_user.id
@@ -1,4 +1,4 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 from app import db, login
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -127,6 +127,9 @@ class ProductStock(db.Model):
         db.UniqueConstraint('product_id', 'city_id', 'neighborhood_id', name='unique_product_location'),
     )
 
+# Minutes a booking blocks when its service has no duration set
+DEFAULT_BOOKING_DURATION = 90
+
 class Booking(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     customer_id = db.Column(db.Integer, db.ForeignKey('user.id'))
@@ -136,6 +139,10 @@ class Booking(db.Model):
     neighborhood_id = db.Column(db.Integer, db.ForeignKey('neighborhood.id'), nullable=True)
     date = db.Column(db.Date)
     time = db.Column(db.Time)
+    # date + time and start + service duration, kept in sync on every write so time windows can use an index
+    start_at = db.Column(db.DateTime, nullable=True)
+    end_at = db.Column(db.DateTime, nullable=True)
+    reminder_sent_at = db.Column(db.DateTime, nullable=True)  # 10-minute reminder to the employee, reset on reschedule
     status = db.Column(db.String(20), default='pending') # pending, assigned, en_route, arrived, in_progress, completed, cancelled
     location_lat = db.Column(db.Float)
     location_lng = db.Column(db.Float)
@@ -152,6 +159,12 @@ class Booking(db.Model):
     vehicle_size_price = db.Column(db.Float, default=0.0) # Store price adjustment at time of booking
     payment_method = db.Column(db.String(20), default='cash') # 'cash' or 'card'
     
+    # Price snapshot set once at booking time (see app.pricing)
+    service_amount = db.Column(db.Float, default=0.0, nullable=False)  # service + vehicle size price
+    products_amount = db.Column(db.Float, default=0.0, nullable=False)
+    discount_amount = db.Column(db.Float, default=0.0, nullable=False)  # code, free wash or subscription
+    total_amount = db.Column(db.Float, default=0.0, nullable=False)  # service - discount + products
+    
     # Relationships
     vehicle = db.relationship('Vehicle')
     service = db.relationship('Service')
@@ -160,6 +173,43 @@ class Booking(db.Model):
     discount_code = db.relationship('DiscountCode')
     subscription = db.relationship('Subscription', backref='wash_bookings')  # Link to subscription
 
+    __table_args__ = (
+        db.Index('ix_booking_status_start_at', 'status', 'start_at'),
+        db.Index('ix_booking_employee_id_start_at', 'employee_id', 'start_at'),
+        db.Index('ix_booking_date_status', 'date', 'status'),
+    )
+
+
+@db.event.listens_for(Booking, 'before_insert')
+@db.event.listens_for(Booking, 'before_update')
+def sync_booking_times(mapper, connection, target):
+    """Recompute start_at/end_at when the date, time or service changes.
+    A moved booking keeps its stored length; only a new service re-reads the service duration."""
+    state = db.inspect(target)
+    if state.attrs.employee_id.history.has_changes():
+        # A reassigned booking needs a reminder for its new employee
+        target.reminder_sent_at = None
+    if target.start_at is not None and not any(
+        state.attrs[name].history.has_changes() for name in ('date', 'time', 'service_id')
+    ):
+        return
+    if target.date is None or target.time is None:
+        target.start_at = target.end_at = None
+        return
+    duration = None
+    if target.start_at is not None and target.end_at is not None and not state.attrs.service_id.history.has_changes():
+        duration = int((target.end_at - target.start_at).total_seconds() // 60)
+    elif target.service_id is not None:
+        duration = connection.execute(
+            db.select(Service.duration).where(Service.id == target.service_id)
+        ).scalar()
+    start_at = datetime.combine(target.date, target.time)
+    if start_at != target.start_at:
+        # A moved booking needs a new reminder
+        target.reminder_sent_at = None
+    target.start_at = start_at
+    target.end_at = start_at + timedelta(minutes=duration or DEFAULT_BOOKING_DURATION)
+
 class DiscountCode(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     code = db.Column(db.String(20), unique=True, nullable=False)
@@ -252,6 +302,10 @@ class PushSubscription(db.Model):
     p256dh = db.Column(db.String(200), nullable=False)
     auth = db.Column(db.String(200), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Delivery health, maintained by app.notifications.apply_delivery_results
+    failure_count = db.Column(db.Integer, default=0, nullable=False)  # consecutive failed deliveries
+    last_failure_at = db.Column(db.DateTime, nullable=True)
+    pruned_at = db.Column(db.DateTime, nullable=True)  # set once the endpoint is dead; no more pushes
 
     user = db.relationship('User', backref=db.backref('push_subscriptions', lazy=True, cascade="all, delete-orphan"))
 
@@ -325,3 +379,114 @@ class EmployeeLocation(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     employee = db.relationship('User', backref=db.backref('location', uselist=False, cascade="all, delete-orphan"))
+
+
+class SlotClaim(db.Model):
+    """A 5-minute tick of an employee's day held by a booking.
+    The unique key makes claiming a slot atomic: two bookings can never hold the same tick."""
+    id = db.Column(db.Integer, primary_key=True)
+    employee_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    slot_start = db.Column(db.Integer, nullable=False)  # minutes since midnight, multiple of 5
+    booking_id = db.Column(db.Integer, db.ForeignKey('booking.id'), nullable=False, index=True)
+
+    booking = db.relationship('Booking', backref=db.backref('slot_claims', lazy='dynamic', cascade="all, delete-orphan"))
+
+    __table_args__ = (
+        db.UniqueConstraint('employee_id', 'date', 'slot_start', name='unique_employee_slot'),
+    )
+
+
+class JobLock(db.Model):
+    """Lease held by the process currently running a background job.
+    Only one process across all workers/servers runs a given job at a time;
+    a lease that is not renewed expires and another process takes over."""
+    name = db.Column(db.String(64), primary_key=True)
+    holder = db.Column(db.String(128), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+
+class CacheVersion(db.Model):
+    """Counter shared by every process, bumped when cached data of that name goes stale
+    (see app.report_cache); each process compares it with the value its entries were built at."""
+    name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.Integer, default=0, nullable=False)
+
+
+class NotificationOutbox(db.Model):
+    """Push notification written in the same transaction as the change it announces.
+    The delivery worker (app.outbox) sends it after commit, with retries."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    payload = db.Column(db.Text, nullable=False)  # JSON notification data
+    status = db.Column(db.String(20), default='pending', nullable=False)  # pending, sending, sent, failed, skipped (no devices)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)  # while sending: end of the claim
+    claimed_by = db.Column(db.String(100), nullable=True)  # delivery batch that holds a 'sending' row
+    last_error = db.Column(db.String(500), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+    user = db.relationship('User')
+
+    __table_args__ = (
+        db.Index('ix_notification_outbox_status_next_attempt_at', 'status', 'next_attempt_at'),
+    )
+
+
+class Broadcast(db.Model):
+    """A notification sent to all customers, fanned out by a background job (app.broadcast).
+    The counters let the admin page show progress and let a restarted job resume."""
+    id = db.Column(db.Integer, primary_key=True)
+    title = db.Column(db.String(64), nullable=False)
+    message = db.Column(db.String(255), nullable=False)
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    status = db.Column(db.String(20), default='queued', nullable=False)  # queued, running, done, failed
+    recipients = db.Column(db.Integer, default=0, nullable=False)  # in-app notifications created
+    pushes_total = db.Column(db.Integer, default=0, nullable=False)
+    pushes_sent = db.Column(db.Integer, default=0, nullable=False)
+    pushes_failed = db.Column(db.Integer, default=0, nullable=False)
+    error = db.Column(db.String(500), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def to_dict(self):
+        done = self.pushes_sent + self.pushes_failed
+        return {
+            'id': self.id,
+            'status': self.status,
+            'recipients': self.recipients,
+            'pushes_total': self.pushes_total,
+            'pushes_sent': self.pushes_sent,
+            'pushes_failed': self.pushes_failed,
+            'progress': round(100.0 * done / self.pushes_total, 1) if self.pushes_total else (100.0 if self.status == 'done' else 0.0),
+            'error': self.error,
+        }
+
+
+class DailyStats(db.Model):
+    """Booking counts and revenue per day, city, neighborhood, employee, service and payment method.
+    Kept current on every booking write by app.daily_stats; 0 / '' stand for a missing dimension."""
+    __tablename__ = 'daily_stats'
+    id = db.Column(db.Integer, primary_key=True)
+    date = db.Column(db.Date, nullable=False)
+    city_id = db.Column(db.Integer, default=0, nullable=False)
+    neighborhood_id = db.Column(db.Integer, default=0, nullable=False)
+    employee_id = db.Column(db.Integer, default=0, nullable=False)
+    service_id = db.Column(db.Integer, default=0, nullable=False)
+    payment_method = db.Column(db.String(20), default='', nullable=False)
+    bookings = db.Column(db.Integer, default=0, nullable=False)  # any status
+    completed = db.Column(db.Integer, default=0, nullable=False)
+    cancelled = db.Column(db.Integer, default=0, nullable=False)
+    # Price snapshot sums of the completed bookings
+    revenue = db.Column(db.Float, default=0.0, nullable=False)  # total_amount
+    service_revenue = db.Column(db.Float, default=0.0, nullable=False)  # service_amount - discount_amount
+    products_revenue = db.Column(db.Float, default=0.0, nullable=False)
+    discount = db.Column(db.Float, default=0.0, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('date', 'city_id', 'neighborhood_id', 'employee_id', 'service_id', 'payment_method',
+                            name='uq_daily_stats_key'),
+        db.Index('ix_daily_stats_employee_id_date', 'employee_id', 'date'),
+    )
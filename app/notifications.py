@@ -1,21 +1,263 @@
 import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
+from datetime import datetime
+from urllib.parse import urlparse
+import requests
+from flask import current_app
+from py_vapid import Vapid
 from pywebpush import webpush, WebPushException
+from sqlalchemy import func, or_, update
+from app import db
 from app.models import PushSubscription
+from app.push_metrics import push_metrics
 
-# VAPID keys for Web Push
-VAPID_PRIVATE_KEY = "ihwqu8ewAWxBRs8J85o6g8VO9FG5RK8kCLUzB2qvqr0"
-VAPID_PUBLIC_KEY = "BEWyGqMWafmjeAy4CHHd2iUAeTlpE7kxSh3GDa6NyMeZ3e3_363xUdx-5mw1yl9l_6bMsBi7EyhUCyNZB1NvR1c"
-VAPID_EMAIL = "mailto:admin@silverclean.com"
+# Signed VAPID tokens are valid this long (push services accept up to 24 hours) ...
+VAPID_TOKEN_SECONDS = 12 * 60 * 60
+# ... and are replaced this long before they expire
+VAPID_REFRESH_SECONDS = 10 * 60
 
-def send_push_notification(user, notification_data):
-    """Send PWA push notification to a user (employee or customer)"""
-    subscriptions = user.push_subscriptions
-    
-    if not subscriptions:
-        print(f"⚠️ User {user.username} has no push subscriptions")
-        return False
-        
-    success_count = 0
+# Deliveries run on a small shared pool so a request never waits on push services
+PUSH_MAX_WORKERS = 8
+# Per push-service round trip (connect + response)
+PUSH_TIMEOUT_SECONDS = 5
+
+# Push services answer these once a subscription no longer exists
+GONE_STATUS_CODES = (404, 410)
+# A subscription is pruned after this many failed deliveries in a row
+MAX_CONSECUTIVE_FAILURES = 5
+# Ids per UPDATE ... WHERE id IN (...)
+PRUNE_BATCH_SIZE = 500
+
+_executor = ThreadPoolExecutor(max_workers=PUSH_MAX_WORKERS, thread_name_prefix='webpush')
+_local = threading.local()
+
+# (subscription id, success, HTTP status) of finished deliveries, appended by the
+# pool threads and written to the database in batches by apply_delivery_results.
+# Every process that sends pushes (outbox and broadcast jobs, reminder service)
+# applies them after each batch, so this only holds the last few deliveries.
+_results = deque()
+
+_client = None
+_client_disabled = False
+_client_lock = threading.Lock()
+
+
+class PushClient:
+    """Sends web push messages signed with the app's VAPID key.
+    The key is parsed once, and the signed VAPID header of each push service
+    (audience) is reused until shortly before it expires, so a delivery only
+    costs the payload encryption."""
+
+    def __init__(self, private_key, claim_email):
+        if os.path.isfile(private_key):
+            self.vapid = Vapid.from_file(private_key_file=private_key)
+        else:
+            self.vapid = Vapid.from_string(private_key=private_key)
+        self.claim_email = claim_email
+        self._headers = {}  # audience -> (expires at, headers)
+        self._lock = threading.Lock()
+
+    def vapid_headers(self, endpoint):
+        """Signed VAPID headers for the push service of an endpoint"""
+        url = urlparse(endpoint)
+        audience = f"{url.scheme}://{url.netloc}"
+        now = time.time()
+
+        cached = self._headers.get(audience)
+        if cached and cached[0] - VAPID_REFRESH_SECONDS > now:
+            return cached[1]
+
+        with self._lock:
+            cached = self._headers.get(audience)
+            if cached and cached[0] - VAPID_REFRESH_SECONDS > now:
+                return cached[1]
+            expires_at = int(now) + VAPID_TOKEN_SECONDS
+            headers = self.vapid.sign({
+                "sub": self.claim_email,
+                "aud": audience,
+                "exp": expires_at
+            })
+            self._headers[audience] = (expires_at, headers)
+            return headers
+
+    def send(self, subscription_info, payload, session=None):
+        """Encrypt and send one message; raises WebPushException on failure"""
+        return webpush(
+            subscription_info=subscription_info,
+            data=payload,
+            headers=self.vapid_headers(subscription_info["endpoint"]),
+            timeout=PUSH_TIMEOUT_SECONDS,
+            requests_session=session
+        )
+
+
+def get_push_client():
+    """The process-wide push client, built from the app config on first use;
+    None (push disabled) while the VAPID keys are not configured"""
+    global _client, _client_disabled
+    if _client is None and not _client_disabled:
+        with _client_lock:
+            if _client is None and not _client_disabled:
+                private_key = current_app.config.get('VAPID_PRIVATE_KEY')
+                if not private_key or not current_app.config.get('VAPID_PUBLIC_KEY'):
+                    print("⚠️ VAPID_PRIVATE_KEY / VAPID_PUBLIC_KEY are not set, push notifications are disabled")
+                    _client_disabled = True
+                else:
+                    _client = PushClient(private_key, current_app.config['VAPID_CLAIM_EMAIL'])
+    return _client
+
+
+def push_enabled():
+    return get_push_client() is not None
+
+
+def _session():
+    """One HTTP session per pool thread, so connections to push services are reused"""
+    session = getattr(_local, 'session', None)
+    if session is None:
+        session = _local.session = requests.Session()
+    return session
+
+
+def _deliver(client, subscription_id, subscription_info, payload, username):
+    """Send one push message; runs on the pool and never touches the database.
+    Returns None on success, otherwise the error text."""
+    host = urlparse(subscription_info["endpoint"]).netloc
+    start = time.monotonic()
+    try:
+        response = client.send(subscription_info, payload, _session())
+        push_metrics.record(host, getattr(response, 'status_code', 201), time.monotonic() - start)
+        _results.append((subscription_id, True, None))
+        return None
+    except WebPushException as ex:
+        print(f"Push notification failed for {username}: {ex}")
+        status_code = ex.response.status_code if ex.response is not None else None
+        push_metrics.record(host, status_code or 'error', time.monotonic() - start)
+        _results.append((subscription_id, False, status_code))
+        return str(ex)
+    except Exception as ex:
+        # Timeouts and connection errors
+        print(f"Push notification error for {username}: {ex}")
+        push_metrics.record(host, 'timeout' if isinstance(ex, requests.Timeout) else 'error', time.monotonic() - start)
+        _results.append((subscription_id, False, None))
+        return str(ex)
+    finally:
+        push_metrics.finished()
+
+
+def _chunks(ids):
+    ids = list(ids)
+    for start in range(0, len(ids), PRUNE_BATCH_SIZE):
+        yield ids[start:start + PRUNE_BATCH_SIZE]
+
+
+def apply_delivery_results(now=None):
+    """Record the delivery results collected so far on their subscriptions and prune
+    dead endpoints (404/410, or MAX_CONSECUTIVE_FAILURES failures in a row).
+    Everything is a few batched UPDATEs; returns {'failed', 'pruned'} counts."""
+    now = now or datetime.utcnow()
+
+    # Per subscription: failures since its last success, and whether that success happened
+    failures, succeeded, gone = {}, set(), set()
+    while _results:
+        subscription_id, ok, status_code = _results.popleft()
+        if ok:
+            failures[subscription_id] = 0
+            succeeded.add(subscription_id)
+            continue
+        failures[subscription_id] = failures.get(subscription_id, 0) + 1
+        if status_code in GONE_STATUS_CODES:
+            gone.add(subscription_id)
+    if not failures:
+        return {'failed': 0, 'pruned': 0}
+
+    # Group by the new value so one statement updates many rows
+    reset, added = {}, {}
+    for subscription_id, count in failures.items():
+        target = reset if subscription_id in succeeded else added
+        target.setdefault(count, []).append(subscription_id)
+
+    for count, ids in reset.items():
+        for chunk in _chunks(ids):
+            db.session.execute(
+                update(PushSubscription)
+                .where(PushSubscription.id.in_(chunk))
+                .values(failure_count=count)
+                .execution_options(synchronize_session=False)
+            )
+    for count, ids in added.items():
+        for chunk in _chunks(ids):
+            db.session.execute(
+                update(PushSubscription)
+                .where(PushSubscription.id.in_(chunk))
+                .values(failure_count=PushSubscription.failure_count + count, last_failure_at=now)
+                .execution_options(synchronize_session=False)
+            )
+
+    failed = [subscription_id for subscription_id, count in failures.items() if count]
+    pruned = 0
+    for chunk in _chunks(failed):
+        pruned += db.session.execute(
+            update(PushSubscription)
+            .where(
+                PushSubscription.id.in_(chunk),
+                PushSubscription.pruned_at.is_(None),
+                or_(
+                    PushSubscription.id.in_(gone),
+                    PushSubscription.failure_count >= MAX_CONSECUTIVE_FAILURES
+                )
+            )
+            .values(pruned_at=now)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+
+    db.session.commit()
+    if pruned:
+        print(f"Pruned {pruned} dead push subscriptions")
+    return {'failed': len(failed), 'pruned': pruned}
+
+
+def prune_subscriptions(now=None):
+    """Record this process's pending results, then prune every subscription whose stored
+    failure_count has reached MAX_CONSECUTIVE_FAILURES (e.g. after the limit was lowered).
+    Works from the database alone, so it can run in a fresh process; returns {'failed', 'pruned'}."""
+    now = now or datetime.utcnow()
+    counts = apply_delivery_results(now)
+    pruned = db.session.execute(
+        update(PushSubscription)
+        .where(
+            PushSubscription.pruned_at.is_(None),
+            PushSubscription.failure_count >= MAX_CONSECUTIVE_FAILURES
+        )
+        .values(pruned_at=now)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.commit()
+    counts['pruned'] += pruned
+    return counts
+
+
+def subscription_counts():
+    """{'active': n, 'pruned': n} push subscriptions, in one query"""
+    counts = {'active': 0, 'pruned': 0}
+    rows = db.session.query(
+        PushSubscription.pruned_at.is_(None), func.count(PushSubscription.id)
+    ).group_by(PushSubscription.pruned_at.is_(None)).all()
+    for active, count in rows:
+        counts['active' if active else 'pruned'] += count
+    return counts
+
+
+def push_to_subscriptions(subscriptions, payload, username):
+    """Queue one delivery per subscription on the pool; returns the futures (none while push is disabled)"""
+    client = get_push_client()
+    if client is None:
+        return []
+    futures = []
     for sub in subscriptions:
         subscription_info = {
             "endpoint": sub.endpoint,
@@ -24,22 +266,29 @@ def send_push_notification(user, notification_data):
                 "auth": sub.auth
             }
         }
-        
-        try:
-            webpush(
-                subscription_info=subscription_info,
-                data=json.dumps(notification_data),
-                vapid_private_key=VAPID_PRIVATE_KEY,
-                vapid_claims={
-                    "sub": VAPID_EMAIL
-                }
-            )
-            success_count += 1
-        except WebPushException as ex:
-            print(f"Push notification failed for {user.username}: {ex}")
-            # Optional: Remove invalid subscription
-            # if ex.response.status_code == 410:
-            #     db.session.delete(sub)
-            #     db.session.commit()
-            
-    return success_count > 0
+        push_metrics.submitted()
+        futures.append(_executor.submit(_deliver, client, sub.id, subscription_info, payload, username))
+    return futures
+
+
+def send_push_notification(user, notification_data, wait=False):
+    """Send PWA push notification to a user (employee or customer).
+    Deliveries to all of the user's devices run concurrently in the background;
+    by default this returns as soon as they are queued. With wait=True it blocks
+    until they finish (bounded by the timeout) and reports whether any succeeded."""
+    if not push_enabled():
+        return False
+
+    subscriptions = [sub for sub in user.push_subscriptions if sub.pruned_at is None]
+
+    if not subscriptions:
+        print(f"⚠️ User {user.username} has no push subscriptions")
+        return False
+
+    futures = push_to_subscriptions(subscriptions, json.dumps(notification_data), user.username)
+
+    if not wait:
+        return True
+
+    done, _ = wait_futures(futures, timeout=PUSH_TIMEOUT_SECONDS * 2)
+    return any(future.result() is None for future in done)
@@ -0,0 +1,186 @@
+"""
+Notification outbox.
+Request handlers only add a NotificationOutbox row next to the change they
+announce, so the push goes out if and only if that transaction commits. A
+background job (see app.jobs) drains pending rows in batches after commit and
+retries failed deliveries with exponential backoff. Each batch first claims its
+rows (pending -> sending) with one conditional UPDATE, so two workers never
+send the same message; pushes still in flight when a batch stops waiting stay
+claimed and are recorded by a later batch instead of being retried.
+"""
+import json
+import uuid
+from datetime import datetime, timedelta
+from concurrent.futures import wait as wait_futures
+from sqlalchemy import and_, or_, update
+from app import db
+from app.jobs import HOLDER, acquire_lock
+from app.models import NotificationOutbox, PushSubscription
+from app.notifications import push_to_subscriptions, push_enabled, apply_delivery_results, PUSH_TIMEOUT_SECONDS
+
+# Job name in job_lock
+DELIVERY_JOB = 'deliver_notifications'
+
+BATCH_SIZE = 100
+MAX_ATTEMPTS = 5
+
+# Retry after 30s, 1m, 2m, 4m ... capped at 30 minutes
+BACKOFF_BASE_SECONDS = 30
+BACKOFF_MAX_SECONDS = 30 * 60
+
+# How long a batch waits for its pushes before moving on
+BATCH_WAIT_SECONDS = PUSH_TIMEOUT_SECONDS * 2
+
+# Job lease: a few batch waits, renewed before every batch
+LEASE_SECONDS = BATCH_WAIT_SECONDS * 3
+
+# A 'sending' row whose claim is this old was left by a worker that died mid-send
+CLAIM_SECONDS = 10 * 60
+
+# Pushes of this process still running after their batch stopped waiting: {message_id: futures}
+_in_flight = {}
+
+
+def enqueue_push(user_id, notification_data):
+    """Queue a push for a user as part of the current transaction (no commit here)"""
+    message = NotificationOutbox(
+        user_id=user_id,
+        payload=json.dumps(notification_data)
+    )
+    db.session.add(message)
+    return message
+
+
+def backoff(attempts):
+    """Delay before the next try after `attempts` failed deliveries"""
+    return timedelta(seconds=min(BACKOFF_BASE_SECONDS * 2 ** (attempts - 1), BACKOFF_MAX_SECONDS))
+
+
+def _claim(batch_size, now):
+    """Mark up to batch_size due messages as sending for this batch; returns them"""
+    # Pending rows, and claims left behind by a worker that died mid-send (never our own in-flight ones)
+    abandoned = [NotificationOutbox.status == 'sending']
+    if _in_flight:
+        abandoned.append(NotificationOutbox.id.notin_(list(_in_flight)))
+    due = or_(NotificationOutbox.status == 'pending', and_(*abandoned))
+    ids = [message_id for message_id, in db.session.query(NotificationOutbox.id).filter(
+        due,
+        NotificationOutbox.next_attempt_at <= now
+    ).order_by(NotificationOutbox.next_attempt_at, NotificationOutbox.id).limit(batch_size)]
+    if not ids:
+        return []
+
+    # The same conditions again: a row another worker claimed in between no longer matches
+    token = f'{HOLDER}:{uuid.uuid4().hex[:12]}'
+    db.session.execute(
+        update(NotificationOutbox)
+        .where(NotificationOutbox.id.in_(ids), due, NotificationOutbox.next_attempt_at <= now)
+        .values(status='sending', claimed_by=token, next_attempt_at=now + timedelta(seconds=CLAIM_SECONDS))
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return NotificationOutbox.query.filter_by(status='sending', claimed_by=token).order_by(NotificationOutbox.id).all()
+
+
+def _record(message, errors, now, counts):
+    """Store the outcome of one message's deliveries (None = delivered)"""
+    message.attempts += 1
+    message.claimed_by = None
+    if any(error is None for error in errors):
+        message.status = 'sent'
+        message.sent_at = now
+        message.last_error = None
+        counts['sent'] += 1
+        return
+
+    message.last_error = (errors[0] or '')[:500]
+    if message.attempts >= MAX_ATTEMPTS:
+        message.status = 'failed'
+        counts['failed'] += 1
+    else:
+        message.status = 'pending'
+        message.next_attempt_at = now + backoff(message.attempts)
+        counts['retried'] += 1
+
+
+def _settle(message, futures, now, counts):
+    """Record a message once any device got it or all its pushes finished; otherwise keep it in flight"""
+    errors = [future.result() for future in futures if future.done()]
+    if None in errors or len(errors) == len(futures):
+        _in_flight.pop(message.id, None)
+        _record(message, errors, now, counts)
+    else:
+        _in_flight[message.id] = futures
+        counts['in_flight'] += 1
+
+
+def deliver_batch(batch_size=BATCH_SIZE, now=None):
+    """Send one batch of due messages; returns {'sent', 'retried', 'failed', 'skipped', 'in_flight'} counts"""
+    now = now or datetime.utcnow()
+    counts = {'sent': 0, 'retried': 0, 'failed': 0, 'skipped': 0, 'in_flight': 0}
+
+    # Earlier pushes that have finished since
+    if _in_flight:
+        for message in NotificationOutbox.query.filter(
+            NotificationOutbox.id.in_(list(_in_flight)), NotificationOutbox.status == 'sending'
+        ).all():
+            _settle(message, _in_flight[message.id], now, counts)
+        db.session.commit()
+
+    # Without VAPID keys messages stay pending until push is configured
+    if not push_enabled():
+        return counts
+
+    messages = _claim(batch_size, now)
+    if not messages:
+        return counts
+
+    # Devices of every recipient in the batch (one query)
+    subscriptions = {}
+    for sub in PushSubscription.query.filter(
+        PushSubscription.user_id.in_({m.user_id for m in messages}),
+        PushSubscription.pruned_at.is_(None)
+    ).all():
+        subscriptions.setdefault(sub.user_id, []).append(sub)
+
+    # All deliveries of the batch run concurrently
+    pending = {}
+    for message in messages:
+        devices = subscriptions.get(message.user_id)
+        if not devices:
+            message.status = 'skipped'
+            message.claimed_by = None
+            counts['skipped'] += 1
+            continue
+        pending[message] = push_to_subscriptions(devices, message.payload, f'user #{message.user_id}')
+
+    all_futures = [future for futures in pending.values() for future in futures]
+    wait_futures(all_futures, timeout=BATCH_WAIT_SECONDS)
+
+    for message, futures in pending.items():
+        _settle(message, futures, now, counts)
+
+    db.session.commit()
+    return counts
+
+
+def drain_outbox(batch_size=BATCH_SIZE, lease=None):
+    """Deliver batches until no due message is left, then record the results on the subscriptions.
+    With lease=(job name, ttl) the job lease is renewed before every batch and draining stops if it was lost."""
+    totals = {'sent': 0, 'retried': 0, 'failed': 0, 'skipped': 0, 'in_flight': 0}
+    while True:
+        counts = deliver_batch(batch_size)
+        for key, value in counts.items():
+            totals[key] += value
+        if sum(counts.values()) < batch_size:
+            break
+        if lease and not acquire_lock(*lease):
+            break
+    # Also picks up pushes sent directly with send_push_notification
+    apply_delivery_results()
+    return totals
+
+
+def run_delivery_job():
+    """Periodic job body (see create_app): drain while holding the delivery lease"""
+    return drain_outbox(lease=(DELIVERY_JOB, LEASE_SECONDS))
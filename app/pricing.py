@@ -0,0 +1,63 @@
+"""
+Booking prices.
+The one formula for what a booking costs, the same one the customer and the
+employee see on the booking card: service price plus vehicle size price, minus
+a free wash, subscription or discount code, plus products. It is applied once
+when the booking is created and stored on the booking (service_amount,
+products_amount, discount_amount, total_amount), so reports and statistics
+sum those columns instead of re-pricing every booking from live tables.
+"""
+from sqlalchemy import func
+from app import db
+from app.models import BookingProduct, Product
+
+
+def quote(service_price, size_price=0, products_amount=0, discount_code=None, free_wash=False, subscription=False):
+    """Price breakdown: {'service_amount', 'products_amount', 'discount_amount', 'total_amount'}.
+    A free wash or a subscription covers the whole service; a code never takes off more than the service."""
+    service_amount = (service_price or 0) + (size_price or 0)
+    products_amount = products_amount or 0
+
+    if free_wash or subscription:
+        discount_amount = service_amount
+    elif discount_code:
+        if discount_code.discount_type == 'percentage':
+            discount_amount = service_amount * discount_code.value / 100
+        else:
+            discount_amount = discount_code.value
+        discount_amount = min(discount_amount, service_amount)
+    else:
+        discount_amount = 0
+
+    return {
+        'service_amount': service_amount,
+        'products_amount': products_amount,
+        'discount_amount': discount_amount,
+        'total_amount': service_amount - discount_amount + products_amount
+    }
+
+
+def products_amount(booking_id):
+    """Total of a booking's products, in one query"""
+    return db.session.query(
+        func.coalesce(func.sum(func.coalesce(Product.price, 0) * func.coalesce(BookingProduct.quantity, 1)), 0)
+    ).select_from(BookingProduct).join(
+        Product, Product.id == BookingProduct.product_id
+    ).filter(
+        BookingProduct.booking_id == booking_id
+    ).scalar()
+
+
+def price_booking(booking):
+    """Store the price snapshot on a booking; call once its service, size price, discount and products are set"""
+    amounts = quote(
+        booking.service.price if booking.service else 0,
+        booking.vehicle_size_price,
+        products_amount(booking.id) if booking.id else 0,
+        discount_code=booking.discount_code,
+        free_wash=booking.used_free_wash,
+        subscription=booking.subscription_id is not None
+    )
+    for name, value in amounts.items():
+        setattr(booking, name, value)
+    return amounts
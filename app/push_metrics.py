@@ -0,0 +1,162 @@
+"""
+Push delivery metrics.
+Every delivery on the push pool (see app.notifications) records its latency and
+outcome here, per push-service host. The numbers live in memory and cover only
+the process serving the page, since it started: deliveries made by other
+workers or by the reminder service are not included. The admin push metrics
+page adds the queue depths and the outbox outcome of the last 24 hours from the
+database, which do cover every process.
+"""
+import os
+import threading
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from app import db
+from app.models import Broadcast, NotificationOutbox
+
+# Upper bounds of the latency histogram buckets, in milliseconds (plus one overflow bucket)
+LATENCY_BUCKETS_MS = [50, 100, 250, 500, 1000, 2500, 5000]
+
+# Period of the outbox delivery rate
+OUTBOX_WINDOW_HOURS = 24
+
+
+class PushMetrics:
+    """Thread-safe counters and latency histograms, per push-service host"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started_at = datetime.utcnow()
+            self._hosts = {}
+            self._pending = 0
+
+    def submitted(self):
+        """A delivery was queued on the pool"""
+        with self._lock:
+            self._pending += 1
+
+    def finished(self):
+        """A queued delivery finished, whatever its outcome"""
+        with self._lock:
+            self._pending = max(self._pending - 1, 0)
+
+    @property
+    def pending(self):
+        """Deliveries queued or running on the pool"""
+        with self._lock:
+            return self._pending
+
+    def record(self, host, status, seconds):
+        """One finished delivery: its HTTP status (or 'error' without a response) and duration"""
+        ms = seconds * 1000
+        with self._lock:
+            stats = self._hosts.get(host)
+            if stats is None:
+                stats = self._hosts[host] = {
+                    'count': 0,
+                    'sent': 0,
+                    'total_ms': 0.0,
+                    'max_ms': 0.0,
+                    'statuses': {},
+                    'buckets': [0] * (len(LATENCY_BUCKETS_MS) + 1)
+                }
+            stats['count'] += 1
+            if isinstance(status, int) and status < 300:
+                stats['sent'] += 1
+            stats['total_ms'] += ms
+            stats['max_ms'] = max(stats['max_ms'], ms)
+            stats['statuses'][str(status)] = stats['statuses'].get(str(status), 0) + 1
+            stats['buckets'][bisect_left(LATENCY_BUCKETS_MS, ms)] += 1
+
+    def snapshot(self):
+        """Copy of the metrics: per host and totals, with averages and percentiles"""
+        with self._lock:
+            hosts = {
+                host: dict(stats, statuses=dict(stats['statuses']), buckets=list(stats['buckets']))
+                for host, stats in self._hosts.items()
+            }
+            started_at = self.started_at
+
+        total = {
+            'count': 0,
+            'sent': 0,
+            'total_ms': 0.0,
+            'max_ms': 0.0,
+            'statuses': {},
+            'buckets': [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        }
+        for stats in hosts.values():
+            total['count'] += stats['count']
+            total['sent'] += stats['sent']
+            total['total_ms'] += stats['total_ms']
+            total['max_ms'] = max(total['max_ms'], stats['max_ms'])
+            for status, count in stats['statuses'].items():
+                total['statuses'][status] = total['statuses'].get(status, 0) + count
+            total['buckets'] = [a + b for a, b in zip(total['buckets'], stats['buckets'])]
+
+        for stats in list(hosts.values()) + [total]:
+            _summarize(stats)
+
+        return {
+            'pid': os.getpid(),
+            'since': started_at.isoformat(),
+            'buckets_ms': LATENCY_BUCKETS_MS,
+            'hosts': hosts,
+            'total': total
+        }
+
+
+def _percentile(buckets, fraction):
+    """Upper bound (ms) of the bucket holding the given fraction of deliveries; None if past the last bound"""
+    count = sum(buckets)
+    if not count:
+        return 0
+    seen = 0
+    for index, bucket in enumerate(buckets):
+        seen += bucket
+        if seen >= count * fraction:
+            return LATENCY_BUCKETS_MS[index] if index < len(LATENCY_BUCKETS_MS) else None
+    return None
+
+
+def _summarize(stats):
+    count = stats['count']
+    stats['success_rate'] = round(stats['sent'] * 100 / count, 1) if count else 0
+    total_ms = stats.pop('total_ms')
+    stats['avg_ms'] = round(total_ms / count, 1) if count else 0
+    stats['max_ms'] = round(stats['max_ms'], 1)
+    stats['p50_ms'] = _percentile(stats['buckets'], 0.5)
+    stats['p95_ms'] = _percentile(stats['buckets'], 0.95)
+
+
+push_metrics = PushMetrics()
+
+
+def queue_depths():
+    """Deliveries queued or running on this process's pool, outbox messages due, broadcasts not finished"""
+    return {
+        'pool': push_metrics.pending,
+        'outbox_pending': NotificationOutbox.query.filter(NotificationOutbox.status == 'pending').count(),
+        'broadcasts_active': Broadcast.query.filter(Broadcast.status.in_(['queued', 'running'])).count()
+    }
+
+
+def outbox_outcome(now=None):
+    """Outbox messages of the last OUTBOX_WINDOW_HOURS by status, and the share delivered to at least one device"""
+    now = now or datetime.utcnow()
+    rows = db.session.query(
+        NotificationOutbox.status, func.count(NotificationOutbox.id)
+    ).filter(
+        NotificationOutbox.created_at >= now - timedelta(hours=OUTBOX_WINDOW_HOURS)
+    ).group_by(NotificationOutbox.status).all()
+
+    counts = {'pending': 0, 'sent': 0, 'failed': 0, 'skipped': 0}
+    counts.update(dict(rows))
+    finished = counts['sent'] + counts['failed'] + counts['skipped']
+    counts['delivered_rate'] = round(counts['sent'] * 100 / finished, 1) if finished else 0
+    return counts
@@ -0,0 +1,199 @@
+"""
+Report result cache.
+The admin reports page is reloaded with the same filters many times a day, so
+its computed numbers are cached per (from_date, to_date, city_id, supervisor
+scope). Ranges that include today keep changing and live a minute; closed
+historical ranges live an hour. Committed changes to bookings or subscriptions
+drop every cached report whose range covers their dates in the process that
+made them. Each process keeps its own cache, so changes to days before today
+also bump the shared cache_version row, and every process drops entries built
+at an older version on lookup; changes to today and later days only reach open
+ranges, which the minute TTL covers.
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from sqlalchemy import event, inspect, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from app import db
+from app.models import Booking, CacheVersion, Subscription
+
+# Bounded size and per-entry lifetime
+MAX_ENTRIES = 256
+OPEN_TTL_SECONDS = 60
+CLOSED_TTL_SECONDS = 3600
+
+# Row in cache_version shared by every process
+VERSION_NAME = 'reports'
+
+# Columns whose change moves a booking or subscription between report figures
+BOOKING_COLUMNS = ('date', 'status', 'neighborhood_id', 'employee_id', 'service_id', 'payment_method',
+                   'service_amount', 'products_amount', 'discount_amount', 'total_amount')
+SUBSCRIPTION_COLUMNS = ('start_date', 'status', 'neighborhood_id', 'package_id')
+
+
+class ReportCache:
+    """LRU cache of report payloads keyed by (from_date, to_date, city_id, scope)"""
+
+    def __init__(self, max_entries=MAX_ENTRIES, open_ttl_seconds=OPEN_TTL_SECONDS,
+                 closed_ttl_seconds=CLOSED_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.open_ttl_seconds = open_ttl_seconds
+        self.closed_ttl_seconds = closed_ttl_seconds
+        self._entries = OrderedDict()  # key -> (expires_at, shared version, payload)
+        self._lock = threading.Lock()
+        self.generation = 0  # bumped by every invalidation
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def key(from_date, to_date, city_id, neighborhood_ids=None):
+        """Cache key; neighborhood_ids is None for admins and the supervisor's scope otherwise"""
+        scope = None if neighborhood_ids is None else tuple(sorted(set(neighborhood_ids)))
+        return (from_date, to_date, city_id, scope)
+
+    def get(self, key, version=0):
+        """Cached payload or None if missing, expired or built before the shared `version`;
+        refreshes the entry's LRU position"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic() or entry[1] != version:
+                if entry is not None:
+                    del self._entries[key]
+                    if entry[1] != version:
+                        self.invalidations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key, payload, generation, version=0, today=None):
+        """Store a payload computed after reading `generation` and the shared `version`;
+        skipped if an invalidation happened meanwhile"""
+        today = today or date.today()
+        ttl = self.open_ttl_seconds if key[1] >= today else self.closed_ttl_seconds
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries.pop(key, None)
+            self._entries[key] = (time.monotonic() + ttl, version, payload)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate_dates(self, days):
+        """Drop every report whose date range covers one of these days"""
+        days = [day for day in days if day is not None]
+        if not days:
+            return
+        with self._lock:
+            self.generation += 1
+            for key in [k for k in self._entries if any(k[0] <= day <= k[1] for day in days)]:
+                del self._entries[key]
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'open_ttl_seconds': self.open_ttl_seconds,
+                'closed_ttl_seconds': self.closed_ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+
+report_cache = ReportCache()
+
+
+def shared_version():
+    """Current value of the shared report version; read it before computing a report"""
+    return db.session.execute(
+        select(CacheVersion.version).where(CacheVersion.name == VERSION_NAME)
+    ).scalar() or 0
+
+
+def _bump_shared_version():
+    """Make every process drop the reports it cached so far; runs in its own transaction
+    because it follows the commit of the change"""
+    try:
+        with db.engine.begin() as connection:
+            bumped = connection.execute(
+                update(CacheVersion).where(CacheVersion.name == VERSION_NAME)
+                .values(version=CacheVersion.version + 1)
+            ).rowcount
+            if not bumped:
+                try:
+                    with connection.begin_nested():
+                        connection.execute(insert(CacheVersion).values(name=VERSION_NAME, version=1))
+                except IntegrityError:
+                    # Another process created the row first
+                    connection.execute(
+                        update(CacheVersion).where(CacheVersion.name == VERSION_NAME)
+                        .values(version=CacheVersion.version + 1)
+                    )
+    except Exception as e:
+        # The change itself is committed; other processes catch up through the TTL
+        print(f"Report cache version bump failed: {e}")
+
+
+def invalidate_reports(days=None):
+    """Drop cached reports covering these days (every report with days=None) after a commit,
+    in this process and, for days before today, in every other one"""
+    if days is None:
+        report_cache.clear()
+        _bump_shared_version()
+        return
+    days = {day for day in days if day is not None}
+    report_cache.invalidate_dates(days)
+    if any(day < date.today() for day in days):
+        _bump_shared_version()
+
+
+def _changed_dates(instance, date_column, columns, deleted=False):
+    """Old and new values of the date column if the object left or entered report figures"""
+    state = inspect(instance)
+    if not (deleted or state.key is None or any(state.attrs[name].history.has_changes() for name in columns)):
+        return []
+    history = state.attrs[date_column].history
+    return list(history.deleted) + [getattr(instance, date_column)]
+
+
+# Collect the dates touched in a transaction while flushing and drop them once it commits,
+# so a report recomputed before the commit cannot repopulate the cache with old numbers
+@event.listens_for(Session, 'before_flush')
+def _collect_dates(session, flush_context, instances):
+    days = session.info.setdefault('report_dates', set())
+    for objects, deleted in ((session.new, False), (session.dirty, False), (session.deleted, True)):
+        for instance in objects:
+            if isinstance(instance, Booking):
+                days.update(_changed_dates(instance, 'date', BOOKING_COLUMNS, deleted))
+            elif isinstance(instance, Subscription):
+                days.update(_changed_dates(instance, 'start_date', SUBSCRIPTION_COLUMNS, deleted))
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_dates(session):
+    days = session.info.pop('report_dates', None)
+    if days:
+        invalidate_reports(days)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_dates(session):
+    session.info.pop('report_dates', None)
@@ -0,0 +1,97 @@
+"""
+Atomic slot reservation.
+A booking claims every 5-minute tick it covers in the slot_claim table. The
+unique (employee_id, date, slot_start) key lets the database decide races:
+when two requests go for the same employee at the same time, one insert
+fails and that request falls through to the next candidate employee.
+Works the same on SQLite and PostgreSQL, with no table or global locks.
+"""
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import Booking, SlotClaim
+from app.availability import ACTIVE_STATUSES, TICK_MINUTES, MINUTES_PER_DAY, booking_duration, to_minutes
+
+
+def _ticks(start, duration):
+    """Tick starts (minutes) covered by [start, start + duration)"""
+    first = start - start % TICK_MINUTES
+    end = min(start + duration, MINUTES_PER_DAY)
+    return range(first, end, TICK_MINUTES)
+
+
+def _claim_rows(booking, employee_id, duration):
+    """slot_claim rows for the ticks of one booking on one employee"""
+    return [
+        {'employee_id': employee_id, 'date': booking.date, 'slot_start': tick, 'booking_id': booking.id}
+        for tick in _ticks(to_minutes(booking.time), duration)
+    ]
+
+
+def _purge_stale_claims(employee_ids, day):
+    """Drop claims whose booking was cancelled, completed or deleted without releasing them"""
+    active_ids = db.session.query(Booking.id).filter(Booking.status.in_(ACTIVE_STATUSES))
+    SlotClaim.query.filter(
+        SlotClaim.employee_id.in_(employee_ids),
+        SlotClaim.date == day,
+        SlotClaim.booking_id.notin_(active_ids)
+    ).delete(synchronize_session=False)
+
+
+def claim_slot(booking, employee_id, duration=None):
+    """Try to claim the booking's slot for one employee; returns True on success.
+    The booking must already be flushed so it has an id.
+    duration defaults to the booking's stored length (end_at - start_at)."""
+    _purge_stale_claims([employee_id], booking.date)
+    if duration is None:
+        duration = booking_duration(booking)
+
+    rows = _claim_rows(booking, employee_id, duration)
+
+    savepoint = db.session.begin_nested()
+    try:
+        db.session.execute(insert(SlotClaim), rows)
+        savepoint.commit()
+    except IntegrityError:
+        # Another booking holds at least one of these ticks
+        savepoint.rollback()
+        return False
+    return True
+
+
+def claim_slots(claims, day):
+    """Claim the stored slots of many (booking, employee_id) pairs on one date with one purge
+    and one insert; if any tick is already taken, claims them one by one instead.
+    Returns the pairs that were claimed."""
+    if not claims:
+        return []
+    _purge_stale_claims(sorted({employee_id for _, employee_id in claims}), day)
+    rows = [
+        row for booking, employee_id in claims
+        for row in _claim_rows(booking, employee_id, booking_duration(booking))
+    ]
+
+    savepoint = db.session.begin_nested()
+    try:
+        db.session.execute(insert(SlotClaim), rows)
+        savepoint.commit()
+        return list(claims)
+    except IntegrityError:
+        # A concurrent booking took some of these ticks: find out which pairs still fit
+        savepoint.rollback()
+    return [(booking, employee_id) for booking, employee_id in claims if claim_slot(booking, employee_id)]
+
+def reserve_employee(booking, candidate_ids, duration=None):
+    """Assign the first candidate whose slot can be claimed; returns the employee id or None"""
+    for employee_id in candidate_ids:
+        if claim_slot(booking, employee_id, duration):
+            booking.employee_id = employee_id
+            return employee_id
+    return None
+
+
+def release_slot(booking):
+    """Free the ticks held by a booking (cancellation, reassignment)"""
+    if booking.id is None:
+        return
+    SlotClaim.query.filter_by(booking_id=booking.id).delete(synchronize_session=False)
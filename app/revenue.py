@@ -0,0 +1,46 @@
+"""
+Revenue aggregates.
+Booking revenue is summed from the daily_stats rollup (see app.daily_stats),
+which holds the price snapshot of every completed booking (see app.pricing)
+per day, so a report costs the same few queries and reads a few hundred rows
+whatever its date range.
+"""
+from sqlalchemy import func
+from app import db
+from app.models import DailyStats
+
+
+def booking_revenue(*filters):
+    """Revenue of the completed bookings in the rollup rows matching `filters` (DailyStats columns), per payment method.
+    Returns {payment_method: {'count', 'service', 'products', 'discount', 'paid'}}:
+    service = service and vehicle size price after discounts, paid = booking total."""
+    rows = db.session.query(
+        DailyStats.payment_method,
+        func.sum(DailyStats.completed),
+        func.sum(DailyStats.service_revenue),
+        func.sum(DailyStats.products_revenue),
+        func.sum(DailyStats.discount),
+        func.sum(DailyStats.revenue)
+    ).filter(
+        DailyStats.completed > 0, *filters
+    ).group_by(DailyStats.payment_method).all()
+
+    return {
+        method: {
+            'count': count or 0,
+            'service': service or 0,
+            'products': products or 0,
+            'discount': discount or 0,
+            'paid': paid or 0
+        }
+        for method, count, service, products, discount, paid in rows
+    }
+
+
+def revenue_totals(by_method):
+    """Sum booking_revenue() rows over all payment methods"""
+    totals = {'count': 0, 'service': 0, 'products': 0, 'discount': 0, 'paid': 0}
+    for row in by_method.values():
+        for key in totals:
+            totals[key] += row[key]
+    return totals
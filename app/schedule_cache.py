@@ -0,0 +1,97 @@
+"""
+Compiled weekly schedules.
+Employee schedules change a few times a month, so the whole table is compiled
+once into {employee_id: {day_of_week: (start_min, end_min)}} together with which
+employees serve each neighborhood, and slot computation reads it from memory.
+The admin routes that edit schedules or employees invalidate it; a TTL bounds
+staleness from edits handled by other workers.
+"""
+import threading
+import time
+from app import db
+from app.models import User, EmployeeSchedule, employee_neighborhoods
+
+# Reload at least this often even without an invalidation
+TTL_SECONDS = 300
+
+
+class ScheduleCache:
+    """Weekly working hours per employee and employee ids per neighborhood"""
+
+    def __init__(self, ttl_seconds=TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._weekly = None  # {employee_id: {day_of_week: (start_min, end_min)}}
+        self._by_neighborhood = None  # {neighborhood_id: [employee_id, ...]} in id order
+        self._expires_at = 0
+        self._lock = threading.Lock()
+        self.loads = 0
+
+    def _load(self):
+        """Compile schedules and neighborhood membership (two queries)"""
+        rows = db.session.query(
+            EmployeeSchedule.employee_id,
+            EmployeeSchedule.day_of_week,
+            EmployeeSchedule.start_time,
+            EmployeeSchedule.end_time
+        ).join(
+            User, User.id == EmployeeSchedule.employee_id
+        ).filter(
+            User.role == 'employee',
+            EmployeeSchedule.is_active == True
+        ).order_by(EmployeeSchedule.employee_id, EmployeeSchedule.id).all()
+
+        weekly = {}
+        for employee_id, day_of_week, start_time, end_time in rows:
+            if start_time is None or end_time is None:
+                continue
+            # Keep the first active schedule per day, as .first() did before
+            weekly.setdefault(employee_id, {}).setdefault(
+                day_of_week,
+                (start_time.hour * 60 + start_time.minute, end_time.hour * 60 + end_time.minute)
+            )
+
+        members = db.session.query(
+            employee_neighborhoods.c.neighborhood_id,
+            employee_neighborhoods.c.employee_id
+        ).join(
+            User, User.id == employee_neighborhoods.c.employee_id
+        ).filter(
+            User.role == 'employee'
+        ).order_by(employee_neighborhoods.c.employee_id).all()
+
+        by_neighborhood = {}
+        for neighborhood_id, employee_id in members:
+            by_neighborhood.setdefault(neighborhood_id, []).append(employee_id)
+
+        self._weekly = weekly
+        self._by_neighborhood = by_neighborhood
+        self._expires_at = time.monotonic() + self.ttl_seconds
+        self.loads += 1
+
+    def _ensure(self):
+        with self._lock:
+            if self._weekly is None or self._expires_at < time.monotonic():
+                self._load()
+            return self._weekly, self._by_neighborhood
+
+    def for_employees(self, employee_ids):
+        """{employee_id: {day_of_week: hours}} for the given employees that have a schedule"""
+        weekly, _ = self._ensure()
+        return {employee_id: weekly[employee_id] for employee_id in employee_ids if employee_id in weekly}
+
+    def for_neighborhood(self, neighborhood_id):
+        """Schedules of the employees serving a neighborhood, in id order"""
+        weekly, by_neighborhood = self._ensure()
+        return {
+            employee_id: weekly[employee_id]
+            for employee_id in by_neighborhood.get(neighborhood_id, ())
+            if employee_id in weekly
+        }
+
+    def invalidate(self):
+        with self._lock:
+            self._weekly = None
+            self._by_neighborhood = None
+
+
+schedule_cache = ScheduleCache()
@@ -0,0 +1,130 @@
+"""
+Availability result cache.
+Free-slot lists per (neighborhood_id, date, duration) only change when a booking or an
+employee's schedule/neighborhoods change, so they are cached in a bounded LRU
+and dropped precisely from those write paths. A lookup that missed hands its
+generation to put(), so slots computed before an invalidation are never stored
+after it. Each process keeps its own cache; a short TTL bounds staleness from
+writes handled by other workers.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+# Bounded size and per-entry lifetime
+MAX_ENTRIES = 512
+TTL_SECONDS = 60
+
+
+class SlotCache:
+    """LRU cache of free slots keyed by (neighborhood_id, date, duration), indexed by employee for invalidation"""
+
+    def __init__(self, max_entries=MAX_ENTRIES, ttl_seconds=TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (expires_at, slots, employee_ids)
+        self._by_employee = {}  # employee_id -> set of keys whose result depends on them
+        self._lock = threading.Lock()
+        self.generation = 0  # bumped by every invalidation
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, neighborhood_id, day, duration):
+        """Cached slots or None; refreshes the entry's LRU position"""
+        key = (neighborhood_id, day, duration)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self._drop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, neighborhood_id, day, duration, slots, employee_ids, generation):
+        """Store slots computed after reading `generation`; skipped if an invalidation happened meanwhile"""
+        key = (neighborhood_id, day, duration)
+        with self._lock:
+            if generation != self.generation:
+                return
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, slots, tuple(employee_ids))
+            for employee_id in employee_ids:
+                self._by_employee.setdefault(employee_id, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.evictions += 1
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for employee_id in entry[2]:
+            keys = self._by_employee.get(employee_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_employee[employee_id]
+
+    def invalidate_employee(self, employee_id, day=None):
+        """Drop every entry that includes this employee (optionally only for one date)"""
+        if employee_id is None:
+            return
+        with self._lock:
+            self.generation += 1
+            for key in list(self._by_employee.get(employee_id, ())):
+                if day is None or key[1] == day:
+                    self._drop(key)
+                    self.invalidations += 1
+
+    def invalidate_neighborhood(self, neighborhood_id, day=None):
+        """Drop entries for a neighborhood (optionally only for one date)"""
+        if neighborhood_id is None:
+            return
+        with self._lock:
+            self.generation += 1
+            for key in [k for k in self._entries if k[0] == neighborhood_id and (day is None or k[1] == day)]:
+                self._drop(key)
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._by_employee.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+
+slot_cache = SlotCache()
+
+
+def invalidate_booking(booking):
+    """A booking was created, cancelled, moved or expired: drop the affected days"""
+    slot_cache.invalidate_employee(booking.employee_id, booking.date)
+    slot_cache.invalidate_neighborhood(booking.neighborhood_id, booking.date)
+
+
+def invalidate_employee(employee_id, neighborhood_ids=()):
+    """An employee's schedule or neighborhoods changed: drop everything they appear in"""
+    slot_cache.invalidate_employee(employee_id)
+    for neighborhood_id in neighborhood_ids:
+        slot_cache.invalidate_neighborhood(neighborhood_id)
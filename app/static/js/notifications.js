@@ -1,4 +1,5 @@
-const publicVapidKey = 'BEWyGqMWafmjeAy4CHHd2iUAeTlpE7kxSh3GDa6NyMeZ3e3_363xUdx-5mw1yl9l_6bMsBi7EyhUCyNZB1NvR1c';
+// Set by the base template from the server config; empty while push is not configured
+const publicVapidKey = window.VAPID_PUBLIC_KEY || '';
 
 document.addEventListener('DOMContentLoaded', () => {
     const enableBtn = document.getElementById('enable-notifications-btn');
@@ -108,9 +109,21 @@ document.addEventListener('DOMContentLoaded', () => {
         }
 
         try {
+            if (!publicVapidKey) {
+                console.log('Push notifications are not configured on the server');
+                return;
+            }
+
             // Check for existing subscription first
             let subscription = await registration.pushManager.getSubscription();
 
+            // A subscription made with an older (rotated) key can no longer receive pushes
+            if (subscription && !sameKey(subscription.options.applicationServerKey, publicVapidKey)) {
+                await subscription.unsubscribe();
+                subscription = null;
+                console.log('Push key changed, subscribing again');
+            }
+
             if (!subscription) {
                 // Create new subscription
                 subscription = await registration.pushManager.subscribe({
@@ -149,6 +162,13 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
+    function sameKey(applicationServerKey, base64String) {
+        if (!applicationServerKey) return true;  // browser does not expose it, keep the subscription
+        const current = new Uint8Array(applicationServerKey);
+        const expected = urlBase64ToUint8Array(base64String);
+        return current.length === expected.length && current.every((byte, i) => byte === expected[i]);
+    }
+
     function urlBase64ToUint8Array(base64String) {
         const padding = '='.repeat((4 - base64String.length % 4) % 4);
         const base64 = (base64String + padding)
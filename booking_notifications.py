@@ -1,17 +1,21 @@
 """
 Booking Notification System with PWA Push Notifications
-Sends notifications to employees 10 minutes before their next booking
+Sends notifications to employees 10 minutes before their next booking.
+Upcoming reminders sit in a priority queue ordered by due time and the process
+sleeps until the next one is due; "reminder sent" is stored on the booking so
+a restart neither repeats nor skips reminders.
 """
 from app import create_app, db
 from app.models import Booking, User
 from datetime import datetime, timedelta
+import heapq
 import time
 import json
 from pywebpush import webpush, WebPushException
 
 app = create_app()
 
-from app.notifications import send_push_notification
+from app.notifications import send_push_notification, apply_delivery_results
 
 def notify_employee(employee, booking):
     """Send notification to employee via PWA push notification"""
@@ -22,9 +26,8 @@ def notify_employee(employee, booking):
     print(f"   المركبة: {booking.vehicle.brand} - {booking.vehicle.plate_number}")
     print(f"   الخدمة: {booking.service.name_ar}")
     
-    # Calculate total price
-    products_total = sum([bp.product.price * bp.quantity for bp in booking.products])
-    grand_total = booking.service.price + products_total
+    # Price stored on the booking when it was made
+    grand_total = booking.total_amount
     
     # Prepare notification data
     notification_data = {
@@ -45,7 +48,7 @@ def notify_employee(employee, booking):
     }
     
     # Send notification using shared utility
-    success = send_push_notification(employee, notification_data)
+    success = send_push_notification(employee, notification_data, wait=True)
     
     if success:
         print("✅ تم إرسال الإشعار بنجاح!")
@@ -54,29 +57,84 @@ def notify_employee(employee, booking):
     
     print("-" * 50)
 
-def check_upcoming_bookings():
-    """Check for bookings starting in 10 minutes"""
-    with app.app_context():
-        # Get current time + 10 minutes
-        target_time = datetime.now() + timedelta(minutes=10)
-        target_date = target_time.date()
-        
-        # Find bookings that start around this time (within 1 minute window)
-        bookings = Booking.query.filter(
-            Booking.date == target_date,
+# Reminder goes out this long before the booking starts
+REMINDER_LEAD = timedelta(minutes=10)
+
+# How far past the next reminders to load, and how often to pick up new/changed bookings
+LOOKAHEAD = timedelta(minutes=30)
+REFRESH_SECONDS = 60
+
+
+class ReminderScheduler:
+    """Priority queue of (due_at, booking_id, start_at) reminders.
+    Entries are never removed in place: a cancelled or moved booking is detected
+    when its entry comes due, and a moved booking simply gets a newer entry."""
+
+    def __init__(self):
+        self._heap = []
+        self._scheduled = {}  # booking_id -> start_at of its live entry
+
+    def refresh(self, now):
+        """Queue reminders for bookings starting within the lookahead (index range scan on start_at)"""
+        rows = db.session.query(Booking.id, Booking.start_at).filter(
             Booking.status == 'assigned',
-            Booking.employee_id.isnot(None)
+            Booking.start_at > now,
+            Booking.start_at <= now + REMINDER_LEAD + LOOKAHEAD,
+            Booking.employee_id.isnot(None),
+            Booking.reminder_sent_at.is_(None)
         ).all()
-        
-        for booking in bookings:
-            if booking.time:
-                # Check if booking time is within 10 minutes ± 30 seconds
-                booking_datetime = datetime.combine(booking.date, booking.time)
-                time_diff = (booking_datetime - datetime.now()).total_seconds()
-                
-                # If between 9:30 and 10:30 minutes (600 ± 30 seconds)
-                if 570 <= time_diff <= 630:
-                    notify_employee(booking.employee, booking)
+        for booking_id, start_at in rows:
+            if self._scheduled.get(booking_id) != start_at:
+                self._scheduled[booking_id] = start_at
+                heapq.heappush(self._heap, (start_at - REMINDER_LEAD, booking_id, start_at))
+
+    def next_due(self):
+        return self._heap[0][0] if self._heap else None
+
+    def run_due(self, now):
+        """Send every reminder that is due, including ones a late wake-up would have skipped"""
+        while self._heap and self._heap[0][0] <= now:
+            _, booking_id, start_at = heapq.heappop(self._heap)
+            if self._scheduled.get(booking_id) != start_at:
+                continue  # superseded by a reschedule
+            del self._scheduled[booking_id]
+            self.send(booking_id, start_at, now)
+
+    def send(self, booking_id, start_at, now):
+        if start_at <= now:
+            return  # already started, a reminder is pointless
+
+        # Mark as sent first; the conditional update fails if the booking was
+        # cancelled, moved or already reminded (e.g. by a previous run)
+        claimed = Booking.query.filter(
+            Booking.id == booking_id,
+            Booking.status == 'assigned',
+            Booking.start_at == start_at,
+            Booking.reminder_sent_at.is_(None)
+        ).update({'reminder_sent_at': now}, synchronize_session=False)
+        db.session.commit()
+        if not claimed:
+            return
+
+        booking = Booking.query.get(booking_id)
+        notify_employee(booking.employee, booking)
+
+    def run_forever(self):
+        next_refresh = datetime.now()
+        while True:
+            with app.app_context():
+                now = datetime.now()
+                if now >= next_refresh:
+                    self.refresh(now)
+                    next_refresh = now + timedelta(seconds=REFRESH_SECONDS)
+                self.run_due(now)
+                # Store delivery results on the subscriptions and prune dead ones
+                apply_delivery_results()
+                db.session.remove()
+
+            # Sleep until the next reminder or refresh, whichever comes first
+            wake_at = min(next_refresh, self.next_due() or next_refresh)
+            time.sleep(max(0, (wake_at - datetime.now()).total_seconds()))
 
 if __name__ == '__main__':
     print("🔔 بدء خدمة إشعارات الحجوزات PWA...")
@@ -88,7 +146,4 @@ if __name__ == '__main__':
     # TODO: Add push_subscription field to User model
     # TODO: Add subscribe endpoint to save employee's push subscription
     
-    while True:
-        check_upcoming_bookings()
-        # Check every 30 seconds
-        time.sleep(30)
+    ReminderScheduler().run_forever()
@@ -29,11 +29,23 @@ class Config:
     REMEMBER_COOKIE_HTTPONLY = True
     REMEMBER_COOKIE_REFRESH_EACH_REQUEST = True
 
-    # VAPID Keys for Web Push Notifications
+    # VAPID Keys for Web Push Notifications - set both in .env (generate a pair with generate_keys.py).
+    # VAPID_PRIVATE_KEY may also be the path of a PEM file. Push is disabled while either is missing.
     VAPID_PUBLIC_KEY = os.environ.get('VAPID_PUBLIC_KEY', '')
-    VAPID_PRIVATE_KEY = os.environ.get('VAPID_PRIVATE_KEY') or os.path.join(os.path.dirname(__file__), 'private_key.pem')
+    VAPID_PRIVATE_KEY = os.environ.get('VAPID_PRIVATE_KEY', '')
     VAPID_CLAIM_EMAIL = os.environ.get('VAPID_CLAIM_EMAIL', 'mailto:admin@silverclean.com')
 
+    # Background sweeper: cancel overdue bookings every N seconds (0 disables it,
+    # e.g. when `flask expire-bookings` runs from a scheduled task instead)
+    EXPIRY_SWEEP_INTERVAL = int(os.environ.get('EXPIRY_SWEEP_INTERVAL', 300))
+
+    # Push notification outbox: deliver queued messages every N seconds (0 disables it,
+    # e.g. when `flask deliver-notifications` runs from a scheduled task instead)
+    OUTBOX_DELIVERY_INTERVAL = int(os.environ.get('OUTBOX_DELIVERY_INTERVAL', 2))
+
+    # Broadcasts to all customers: check for queued ones every N seconds (0 disables it)
+    BROADCAST_INTERVAL = int(os.environ.get('BROADCAST_INTERVAL', 5))
+
     # Mail Settings - All from environment variables
     MAIL_SERVER = os.environ.get('MAIL_SERVER', 'smtp.googlemail.com')
     MAIL_PORT = int(os.environ.get('MAIL_PORT', 587))
@@ -0,0 +1,40 @@
+"""Add broadcast table for background notification fan-out
+
+Revision ID: a3d7e5c9b162
+Revises: f2c9a4b7e618
+Create Date: 2026-10-18 16:48:33.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3d7e5c9b162'
+down_revision = 'f2c9a4b7e618'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('broadcast',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('title', sa.String(length=64), nullable=False),
+    sa.Column('message', sa.String(length=255), nullable=False),
+    sa.Column('created_by', sa.Integer(), nullable=True),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('recipients', sa.Integer(), nullable=False),
+    sa.Column('pushes_total', sa.Integer(), nullable=False),
+    sa.Column('pushes_sent', sa.Integer(), nullable=False),
+    sa.Column('pushes_failed', sa.Integer(), nullable=False),
+    sa.Column('error', sa.String(length=500), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('started_at', sa.DateTime(), nullable=True),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['created_by'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('broadcast')
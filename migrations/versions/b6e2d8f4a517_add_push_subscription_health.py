@@ -0,0 +1,30 @@
+"""Track delivery failures on push subscriptions and prune dead ones
+
+Revision ID: b6e2d8f4a517
+Revises: a3d7e5c9b162
+Create Date: 2026-10-18 17:25:10.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6e2d8f4a517'
+down_revision = 'a3d7e5c9b162'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('push_subscription', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('failure_count', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('last_failure_at', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('pruned_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('push_subscription', schema=None) as batch_op:
+        batch_op.drop_column('pruned_at')
+        batch_op.drop_column('last_failure_at')
+        batch_op.drop_column('failure_count')
@@ -0,0 +1,77 @@
+"""Add slot_claim table for atomic booking reservations
+
+Revision ID: b7d2e4a91c3f
+Revises: 2fed7f610de0
+Create Date: 2026-10-18 09:12:41.000000
+
+"""
+from datetime import date
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d2e4a91c3f'
+down_revision = '2fed7f610de0'
+branch_labels = None
+depends_on = None
+
+ACTIVE_STATUSES = ('pending', 'assigned', 'en_route', 'arrived', 'in_progress')
+# Same default and tick size as app.models.DEFAULT_BOOKING_DURATION and app.reservations
+BOOKING_DURATION_MINUTES = 90
+TICK_MINUTES = 5
+
+
+def upgrade():
+    slot_claim = op.create_table('slot_claim',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('employee_id', sa.Integer(), nullable=False),
+    sa.Column('date', sa.Date(), nullable=False),
+    sa.Column('slot_start', sa.Integer(), nullable=False),
+    sa.Column('booking_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['booking_id'], ['booking.id'], ),
+    sa.ForeignKeyConstraint(['employee_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('employee_id', 'date', 'slot_start', name='unique_employee_slot')
+    )
+    with op.batch_alter_table('slot_claim', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_slot_claim_booking_id'), ['booking_id'], unique=False)
+
+    # Backfill claims for upcoming active bookings (first booking wins on overlaps)
+    booking = sa.table('booking',
+        sa.column('id', sa.Integer), sa.column('employee_id', sa.Integer), sa.column('service_id', sa.Integer),
+        sa.column('date', sa.Date), sa.column('time', sa.Time), sa.column('status', sa.String))
+    service = sa.table('service', sa.column('id', sa.Integer), sa.column('duration', sa.Integer))
+    rows = op.get_bind().execute(
+        sa.select(booking.c.id, booking.c.employee_id, booking.c.date, booking.c.time, service.c.duration)
+        .select_from(booking.outerjoin(service, service.c.id == booking.c.service_id))
+        .where(booking.c.status.in_(ACTIVE_STATUSES))
+        .where(booking.c.employee_id.isnot(None))
+        .where(booking.c.date >= date.today())
+        .order_by(booking.c.id)
+    ).fetchall()
+
+    seen = set()
+    claims = []
+    for booking_id, employee_id, booking_date, booking_time, duration in rows:
+        if booking_time is None:
+            continue
+        start = booking_time.hour * 60 + booking_time.minute
+        # Each booking blocks its service's duration, as claim_slot does at runtime
+        end = min(start + (duration or BOOKING_DURATION_MINUTES), 24 * 60)
+        for tick in range(start - start % TICK_MINUTES, end, TICK_MINUTES):
+            key = (employee_id, booking_date, tick)
+            if key in seen:
+                continue
+            seen.add(key)
+            claims.append({'employee_id': employee_id, 'date': booking_date, 'slot_start': tick, 'booking_id': booking_id})
+
+    if claims:
+        op.bulk_insert(slot_claim, claims)
+
+
+def downgrade():
+    with op.batch_alter_table('slot_claim', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_slot_claim_booking_id'))
+
+    op.drop_table('slot_claim')
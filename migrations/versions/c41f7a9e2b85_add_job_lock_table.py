@@ -0,0 +1,29 @@
+"""Add job_lock table for single-instance background jobs
+
+Revision ID: c41f7a9e2b85
+Revises: b7d2e4a91c3f
+Create Date: 2026-10-18 11:02:17.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41f7a9e2b85'
+down_revision = 'b7d2e4a91c3f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('job_lock',
+    sa.Column('name', sa.String(length=64), nullable=False),
+    sa.Column('holder', sa.String(length=128), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('job_lock')
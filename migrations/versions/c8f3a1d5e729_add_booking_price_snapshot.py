@@ -0,0 +1,94 @@
+"""Add price snapshot columns to booking
+
+Revision ID: c8f3a1d5e729
+Revises: b6e2d8f4a517
+Create Date: 2026-10-18 18:10:42.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c8f3a1d5e729'
+down_revision = 'b6e2d8f4a517'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('booking', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('service_amount', sa.Float(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('products_amount', sa.Float(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('discount_amount', sa.Float(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('total_amount', sa.Float(), nullable=False, server_default='0'))
+        batch_op.create_index('ix_booking_date_status', ['date', 'status'], unique=False)
+
+    # Backfill with the app.pricing formula from the current service, product and code prices
+    bind = op.get_bind()
+    booking = sa.table('booking',
+        sa.column('id', sa.Integer), sa.column('service_id', sa.Integer), sa.column('discount_code_id', sa.Integer),
+        sa.column('subscription_id', sa.Integer), sa.column('used_free_wash', sa.Boolean),
+        sa.column('vehicle_size_price', sa.Float), sa.column('service_amount', sa.Float),
+        sa.column('products_amount', sa.Float), sa.column('discount_amount', sa.Float), sa.column('total_amount', sa.Float))
+    service = sa.table('service', sa.column('id', sa.Integer), sa.column('price', sa.Float))
+    discount_code = sa.table('discount_code', sa.column('id', sa.Integer), sa.column('type', sa.String),
+        sa.column('value', sa.Float))
+    booking_product = sa.table('booking_product', sa.column('booking_id', sa.Integer),
+        sa.column('product_id', sa.Integer), sa.column('quantity', sa.Integer))
+    product = sa.table('product', sa.column('id', sa.Integer), sa.column('price', sa.Float))
+
+    products = sa.select(
+        booking_product.c.booking_id,
+        sa.func.sum(sa.func.coalesce(product.c.price, 0) * sa.func.coalesce(booking_product.c.quantity, 1)).label('amount')
+    ).select_from(
+        booking_product.join(product, product.c.id == booking_product.c.product_id)
+    ).group_by(booking_product.c.booking_id).subquery()
+
+    rows = bind.execute(
+        sa.select(booking.c.id, service.c.price, booking.c.vehicle_size_price, products.c.amount,
+                  discount_code.c.type, discount_code.c.value, booking.c.used_free_wash, booking.c.subscription_id)
+        .select_from(
+            booking.outerjoin(service, service.c.id == booking.c.service_id)
+            .outerjoin(discount_code, discount_code.c.id == booking.c.discount_code_id)
+            .outerjoin(products, products.c.booking_id == booking.c.id)
+        )
+    ).fetchall()
+
+    updates = []
+    for booking_id, service_price, size_price, products_amount, code_type, code_value, free_wash, subscription_id in rows:
+        service_amount = (service_price or 0) + (size_price or 0)
+        products_amount = products_amount or 0
+        if free_wash or subscription_id is not None:
+            discount_amount = service_amount
+        elif code_type == 'percentage':
+            discount_amount = min(service_amount * (code_value or 0) / 100, service_amount)
+        elif code_type is not None:
+            discount_amount = min(code_value or 0, service_amount)
+        else:
+            discount_amount = 0
+        updates.append({
+            'b_id': booking_id,
+            'b_service_amount': service_amount,
+            'b_products_amount': products_amount,
+            'b_discount_amount': discount_amount,
+            'b_total_amount': service_amount - discount_amount + products_amount,
+        })
+
+    if updates:
+        bind.execute(
+            booking.update()
+            .where(booking.c.id == sa.bindparam('b_id'))
+            .values(service_amount=sa.bindparam('b_service_amount'), products_amount=sa.bindparam('b_products_amount'),
+                    discount_amount=sa.bindparam('b_discount_amount'), total_amount=sa.bindparam('b_total_amount')),
+            updates
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('booking', schema=None) as batch_op:
+        batch_op.drop_index('ix_booking_date_status')
+        batch_op.drop_column('total_amount')
+        batch_op.drop_column('discount_amount')
+        batch_op.drop_column('products_amount')
+        batch_op.drop_column('service_amount')
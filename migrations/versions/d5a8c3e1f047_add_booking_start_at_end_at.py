@@ -0,0 +1,65 @@
+"""Add indexed start_at/end_at timestamps to booking
+
+Revision ID: d5a8c3e1f047
+Revises: c41f7a9e2b85
+Create Date: 2026-10-18 12:40:05.000000
+
+"""
+from datetime import datetime, timedelta
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5a8c3e1f047'
+down_revision = 'c41f7a9e2b85'
+branch_labels = None
+depends_on = None
+
+DEFAULT_BOOKING_DURATION = 90
+
+
+def upgrade():
+    with op.batch_alter_table('booking', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('start_at', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('end_at', sa.DateTime(), nullable=True))
+        batch_op.create_index('ix_booking_status_start_at', ['status', 'start_at'], unique=False)
+        batch_op.create_index('ix_booking_employee_id_start_at', ['employee_id', 'start_at'], unique=False)
+
+    # Backfill from date + time and the service duration
+    bind = op.get_bind()
+    booking = sa.table('booking',
+        sa.column('id', sa.Integer), sa.column('date', sa.Date), sa.column('time', sa.Time),
+        sa.column('service_id', sa.Integer), sa.column('start_at', sa.DateTime), sa.column('end_at', sa.DateTime))
+    service = sa.table('service', sa.column('id', sa.Integer), sa.column('duration', sa.Integer))
+
+    rows = bind.execute(
+        sa.select(booking.c.id, booking.c.date, booking.c.time, service.c.duration)
+        .select_from(booking.outerjoin(service, service.c.id == booking.c.service_id))
+        .where(booking.c.date.isnot(None), booking.c.time.isnot(None))
+    ).fetchall()
+
+    updates = []
+    for booking_id, booking_date, booking_time, duration in rows:
+        start_at = datetime.combine(booking_date, booking_time)
+        updates.append({
+            'b_id': booking_id,
+            'b_start_at': start_at,
+            'b_end_at': start_at + timedelta(minutes=duration or DEFAULT_BOOKING_DURATION),
+        })
+
+    if updates:
+        bind.execute(
+            booking.update()
+            .where(booking.c.id == sa.bindparam('b_id'))
+            .values(start_at=sa.bindparam('b_start_at'), end_at=sa.bindparam('b_end_at')),
+            updates
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('booking', schema=None) as batch_op:
+        batch_op.drop_index('ix_booking_employee_id_start_at')
+        batch_op.drop_index('ix_booking_status_start_at')
+        batch_op.drop_column('end_at')
+        batch_op.drop_column('start_at')
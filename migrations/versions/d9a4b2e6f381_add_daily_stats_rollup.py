@@ -0,0 +1,83 @@
+"""Add daily_stats booking rollup
+
+Revision ID: d9a4b2e6f381
+Revises: c8f3a1d5e729
+Create Date: 2026-10-18 19:02:17.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd9a4b2e6f381'
+down_revision = 'c8f3a1d5e729'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('daily_stats',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('date', sa.Date(), nullable=False),
+        sa.Column('city_id', sa.Integer(), nullable=False),
+        sa.Column('neighborhood_id', sa.Integer(), nullable=False),
+        sa.Column('employee_id', sa.Integer(), nullable=False),
+        sa.Column('service_id', sa.Integer(), nullable=False),
+        sa.Column('payment_method', sa.String(length=20), nullable=False),
+        sa.Column('bookings', sa.Integer(), nullable=False),
+        sa.Column('completed', sa.Integer(), nullable=False),
+        sa.Column('cancelled', sa.Integer(), nullable=False),
+        sa.Column('revenue', sa.Float(), nullable=False),
+        sa.Column('service_revenue', sa.Float(), nullable=False),
+        sa.Column('products_revenue', sa.Float(), nullable=False),
+        sa.Column('discount', sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('date', 'city_id', 'neighborhood_id', 'employee_id', 'service_id', 'payment_method',
+                            name='uq_daily_stats_key')
+    )
+    with op.batch_alter_table('daily_stats', schema=None) as batch_op:
+        batch_op.create_index('ix_daily_stats_employee_id_date', ['employee_id', 'date'], unique=False)
+
+    # Fill it from the existing bookings
+    booking = sa.table('booking',
+        sa.column('id', sa.Integer), sa.column('date', sa.Date), sa.column('neighborhood_id', sa.Integer),
+        sa.column('employee_id', sa.Integer), sa.column('service_id', sa.Integer),
+        sa.column('payment_method', sa.String), sa.column('status', sa.String),
+        sa.column('service_amount', sa.Float), sa.column('products_amount', sa.Float),
+        sa.column('discount_amount', sa.Float), sa.column('total_amount', sa.Float))
+    neighborhood = sa.table('neighborhood', sa.column('id', sa.Integer), sa.column('city_id', sa.Integer))
+    daily_stats = sa.table('daily_stats', *(sa.column(name) for name in (
+        'date', 'city_id', 'neighborhood_id', 'employee_id', 'service_id', 'payment_method',
+        'bookings', 'completed', 'cancelled', 'revenue', 'service_revenue', 'products_revenue', 'discount')))
+
+    completed = booking.c.status == 'completed'
+    dimensions = (
+        booking.c.date,
+        sa.func.coalesce(neighborhood.c.city_id, 0),
+        sa.func.coalesce(booking.c.neighborhood_id, 0),
+        sa.func.coalesce(booking.c.employee_id, 0),
+        sa.func.coalesce(booking.c.service_id, 0),
+        sa.func.coalesce(booking.c.payment_method, '')
+    )
+    rows = sa.select(
+        *dimensions,
+        sa.func.count(booking.c.id),
+        sa.func.sum(sa.case((completed, 1), else_=0)),
+        sa.func.sum(sa.case((booking.c.status == 'cancelled', 1), else_=0)),
+        sa.func.sum(sa.case((completed, booking.c.total_amount), else_=0)),
+        sa.func.sum(sa.case((completed, booking.c.service_amount - booking.c.discount_amount), else_=0)),
+        sa.func.sum(sa.case((completed, booking.c.products_amount), else_=0)),
+        sa.func.sum(sa.case((completed, booking.c.discount_amount), else_=0))
+    ).select_from(
+        booking.outerjoin(neighborhood, neighborhood.c.id == booking.c.neighborhood_id)
+    ).where(booking.c.date.isnot(None)).group_by(*dimensions)
+
+    op.get_bind().execute(daily_stats.insert().from_select(list(daily_stats.c.keys()), rows))
+
+
+def downgrade():
+    with op.batch_alter_table('daily_stats', schema=None) as batch_op:
+        batch_op.drop_index('ix_daily_stats_employee_id_date')
+
+    op.drop_table('daily_stats')
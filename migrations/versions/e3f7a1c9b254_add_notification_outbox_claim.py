@@ -0,0 +1,30 @@
+"""Let outbox deliveries claim their rows before sending
+
+Revision ID: e3f7a1c9b254
+Revises: d9a4b2e6f381
+Create Date: 2026-10-19 09:20:33.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3f7a1c9b254'
+down_revision = 'd9a4b2e6f381'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('notification_outbox', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('claimed_by', sa.String(length=100), nullable=True))
+
+
+def downgrade():
+    # Rows caught mid-send go back to the queue
+    notification_outbox = sa.table('notification_outbox', sa.column('status', sa.String))
+    op.execute(notification_outbox.update().where(notification_outbox.c.status == 'sending').values(status='pending'))
+
+    with op.batch_alter_table('notification_outbox', schema=None) as batch_op:
+        batch_op.drop_column('claimed_by')
@@ -0,0 +1,26 @@
+"""Add reminder_sent_at to booking
+
+Revision ID: e8b1f6d2c934
+Revises: d5a8c3e1f047
+Create Date: 2026-10-18 14:05:52.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8b1f6d2c934'
+down_revision = 'd5a8c3e1f047'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('booking', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('reminder_sent_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('booking', schema=None) as batch_op:
+        batch_op.drop_column('reminder_sent_at')
@@ -0,0 +1,28 @@
+"""Add cache_version table for cross-process cache invalidation
+
+Revision ID: f4b8c2d6a917
+Revises: e3f7a1c9b254
+Create Date: 2026-10-19 10:41:05.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f4b8c2d6a917'
+down_revision = 'e3f7a1c9b254'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('cache_version',
+    sa.Column('name', sa.String(length=64), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('cache_version')